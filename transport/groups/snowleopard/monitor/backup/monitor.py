@@ -23,9 +23,18 @@
 #   2016-07-18  Todd Valentic
 #               Initial implementation.
 #
+#   2026-10-19  Use the in-tree parallel block compressor (pcompress)
+#                   instead of shelling out to pbzip2. The compress
+#                   script is still used if compress.script is set.
+#
+#   2026-10-19  Put a summary of each backup in the cache (backup.time,
+#                   backup.numfiles, backup.failed, backup.bytes).
+#
 ##################################################################
 
 from DataMonitor import DataMonitor
+from pcompress import BlockCompressor
+from Transport.Util import datefunc
 
 import sys
 import os
@@ -44,6 +53,17 @@ class Sampler (DataMonitor):
 
         self.keepSource = self.getboolean('source.keep',False)
 
+        self.cache = self.connect('cache')
+        self.writer = self.get('instrument.name','backup')
+
+        ttl = self.getDeltaTime('cache.ttl',0)
+        self.cacheTTL = datefunc.timedelta_as_seconds(ttl)
+
+        self.compressScript = self.get('compress.script')
+        self.compressor = BlockCompressor('bz2',
+                            level=self.getint('compress.level',1),
+                            workers=self.getint('compress.workers'))
+
     def validFilename(self,filename):
 
         for spec in self.excludeFiles:
@@ -89,10 +109,12 @@ class Sampler (DataMonitor):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
-        cmd = 'compress %s %s' % (filename,outputname)
-
-        if not self.runScript(cmd):
-            raise IOError('Problem compressing file')
+        if self.compressScript:
+            cmd = '%s %s %s' % (self.compressScript,filename,outputname)
+            if not self.runScript(cmd):
+                raise IOError('Problem compressing file')
+        else:
+            self.compressor.compressFile(filename,outputname)
 
         if not self.keepSource:
             os.remove(filename)
@@ -130,8 +152,32 @@ class Sampler (DataMonitor):
 
         results.set('DEFAULT','time.stop',str(self.currentTime()))
 
+        self.putSummary(results)
+
         return results
 
+    def putSummary(self,results):
+
+        numfiles = 0
+        numbytes = 0
+
+        for section in results.sections():
+            if results.has_option(section,'backup.size'):
+                numfiles += 1
+                numbytes += results.getint(section,'backup.size')
+
+        values = {
+            'backup.time':      results.get('DEFAULT','time.stop'),
+            'backup.numfiles':  numfiles,
+            'backup.failed':    len(results.sections())-numfiles,
+            'backup.bytes':     float(numbytes)    # can pass XML-RPC int
+            }
+
+        try:
+            self.cache.put_many(values,self.cacheTTL,self.writer)
+        except:
+            self.log.exception('Problem putting backup summary in cache')
+
     def sample(self):
         self.log.info('Backing up files')
 
@@ -139,6 +185,7 @@ class Sampler (DataMonitor):
             self.powerUp()
             results = self.backupFiles()
         finally:
+            self.compressor.close()
             self.powerDown()
 
         return results
@@ -7,10 +7,24 @@
 #   2016-07-14  Todd Valentic
 #               Initial implementation
 #
+#   2026-10-19  Read the SunSaver data from the shared memory cache,
+#                   falling back to the cache service.
+#
+#   2026-10-19  Optionally use the mean T_amb over temperature.window
+#                   from the cache history.
+#
+#   2026-10-19  Use get_many for the cache service fallback and put
+#                   the fan state and temperature used in the cache.
+#
+#   2026-10-19  Average the T_amb samples over the window directly
+#                   rather than the means of the history steps.
+#
 ###################################################################
 
 from DataMonitor import DataMonitor
 from pack import packFloat
+from sharedcache import SharedCache
+from Transport.Util import datefunc
 
 import sys
 import sunsaver
@@ -22,6 +36,11 @@ class FanMonitor(DataMonitor):
         DataMonitor.__init__(self,argv)
 
         self.cache  = self.connect('cache')
+        self.shared = SharedCache()
+        self.writer = self.get('instrument.name','fan')
+
+        ttl = self.getDeltaTime('cache.ttl',0)
+        self.cacheTTL = datefunc.timedelta_as_seconds(ttl)
 
         self.curState = None
 
@@ -37,18 +56,71 @@ class FanMonitor(DataMonitor):
         self.onTemperature = schedule.getfloat('temperature.on',onTemperature)
         self.offTemperature = schedule.getfloat('temperature.off',offTemperature)
 
+        window = self.getDeltaTime('temperature.window',0)
+        self.window = datefunc.timedelta_as_seconds(window)
+
+    def readSunSaver(self):
+
+        # KeyError means there is no current value, anything else is a
+        # problem with the shared memory copy
+
+        try:
+            return self.shared.get('sunsaver')
+        except KeyError:
+            raise
+        except:
+            pass
+
+        # get_many leaves out missing or expired keys
+
+        values = self.cache.get_many(['sunsaver'])
+
+        if 'sunsaver' not in values:
+            raise KeyError('sunsaver')
+
+        return values['sunsaver']
+
+    def putState(self,state,Tamb):
+        try:
+            self.cache.put_many({'fan': state, 'fan.T_amb': Tamb},
+                                self.cacheTTL,self.writer)
+        except:
+            self.log.exception('Problem putting fan state in cache')
+
+    def meanTemperature(self,Tamb):
+
+        # Smooth out single readings with the mean over the window.
+        # The samples can fall in two steps of the history, so they
+        # are fetched as is and averaged here.
+
+        try:
+            results = self.cache.history('sunsaver.T_amb',-self.window,0)
+        except:
+            self.log.exception('Problem reading T_amb history')
+            return Tamb
+
+        if not results:
+            return Tamb
+
+        total = sum([value for timestamp,value in results])
+
+        return total/len(results)
+
     def sample(self):
 
         self.getParameters(self.curSchedule)
 
         try:
-            data = sunsaver.Parse(self.cache.get('sunsaver'))
+            data = sunsaver.Parse(self.readSunSaver())
         except:
             self.log.info('No valid SunSaver data')
             return None
 
         Tamb = float(data['T_amb'])
 
+        if self.window:
+            Tamb = self.meanTemperature(Tamb)
+
         if Tamb<=self.offTemperature:
             self.setResources('fan=off')
             nextState = 'off'
@@ -62,6 +134,9 @@ class FanMonitor(DataMonitor):
             self.log.info('Turning fan %s to %s' % (self.curState,nextState))
             self.curState = nextState
 
+        if self.curState:
+            self.putState(self.curState,Tamb)
+
         return None
 
 if __name__ == '__main__':
@@ -48,6 +48,12 @@
 #   2016-07-13  Todd Valentic
 #               Add Ettus GPSDO support
 #
+#   2026-10-19  Reserve the Ettus ahead of the next sample instead of
+#                   waiting powerup.delay after turning it on. The
+#                   resource service turns it on early enough for it
+#                   to be ready (resource.ettus.ready.command) and
+#                   allocate() returns once it is.
+#
 ###################################################################
 
 from DataMonitor import DataMonitor
@@ -56,6 +62,7 @@ from pack import packFloat
 import sys
 import gps
 import struct
+import time
 
 class GPSMonitor(DataMonitor):
 
@@ -63,8 +70,8 @@ class GPSMonitor(DataMonitor):
         DataMonitor.__init__(self,argv)
 
         self.cache  = self.connect('cache')
+        self.resources = self.connect('resources')
 
-        self.powerupDelay = self.getDeltaTime('powerup.delay','1:00')
         self.powerupTimeout = self.getDeltaTime('powerup.timeout','5:00')
         self.sharedfile = self.get('current.gps')
 
@@ -108,11 +115,23 @@ class GPSMonitor(DataMonitor):
             self.update(data)
         finally:
             self.powerDown()
+            self.reserveNext()
         return data
 
+    def reserveNext(self):
+
+        # Samples are synced to the schedule rate
+
+        rate = self.curSchedule.getRate('rate',60)
+        delay = rate - time.time()%rate
+
+        try:
+            self.resources.reserve(self.name,['ettus=on'],delay)
+        except:
+            self.log.exception('Problem reserving ettus')
+
     def powerUp(self):
         self.setResources('ettus=on')
-        self.wait(self.powerupDelay)
         self.gps = gps.GPS(self.device,self.baudrate)
         self.gps.setup()
 
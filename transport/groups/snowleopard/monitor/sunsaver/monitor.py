@@ -7,11 +7,18 @@
 #   2016-07-05  Todd Valentic
 #               Initial implementation.
 #
+#   2026-10-19  Also put the fields in cache.fields as numeric
+#                   sunsaver.<field> keys for the cache history.
+#
+#   2026-10-19  Tag the cache entries with the instrument name and
+#                   an optional cache.ttl.
+#
 ##################################################################
 
 from DataMonitor import DataMonitor
+from Transport.Util import datefunc
 
-from sunsaver import SunSaver
+from sunsaver import SunSaver, Parse
 
 import sys
 
@@ -22,11 +29,22 @@ class Sampler (DataMonitor):
         self.cache = self.connect('cache')
         self.device = self.get('sunsaver.device','/dev/ttyS0')
         self.sunsaver = SunSaver(self.device)
+        self.fields = self.getList('cache.fields',['T_amb'])
+        self.writer = self.get('instrument.name','sunsaver')
+        ttl = self.getDeltaTime('cache.ttl',0)
+        self.cacheTTL = datefunc.timedelta_as_seconds(ttl)
 
     def sample(self):
         self.log.info('Reading SunSaver')
         results = self.sunsaver.sample()
-        self.cache.put('sunsaver',results)
+        values = {'sunsaver': results}
+        try:
+            data = Parse(results)
+            for field in self.fields:
+                values['sunsaver.%s' % field] = float(data[field])
+        except:
+            self.log.exception('Problem parsing fields for cache')
+        self.cache.put_many(values,self.cacheTTL,self.writer)
         return results 
 
     def write(self,output,timestamp,data):
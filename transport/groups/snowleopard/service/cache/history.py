@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Cache history
+#
+#   A fixed size ring of (time,value) samples for a numeric cache
+#   key, stored in two arrays of doubles (16 bytes a sample). Once
+#   full, each new sample replaces the oldest.
+#
+#   query() returns the samples between two times, either as they
+#   are or reduced to one value per step seconds (the min, max or
+#   mean of the samples in each step). Samples are kept in the order
+#   they were written, so a clock that steps back just gives a range
+#   with older times in it; they are filtered by time, not assumed
+#   to be sorted.
+#
+#   2026-10-19  Initial implementation
+#
+#   2026-10-19  Keep a running count, sum, min and max per step
+#                   instead of a list of the samples.
+#
+####################################################################
+
+from array import array
+
+Methods = ['mean','min','max']
+
+class HistoryRing:
+
+    def __init__(self,capacity):
+        self.capacity   = capacity
+        self.times      = array('d',[0]*capacity)
+        self.values     = array('d',[0]*capacity)
+        self.next       = 0
+        self.count      = 0
+
+    def append(self,timestamp,value):
+        self.times[self.next] = timestamp
+        self.values[self.next] = value
+        self.next = (self.next+1) % self.capacity
+        self.count = min(self.count+1,self.capacity)
+
+    def samples(self):
+        # Oldest first
+        start = (self.next-self.count) % self.capacity
+        for offset in xrange(self.count):
+            index = (start+offset) % self.capacity
+            yield self.times[index],self.values[index]
+
+    def query(self,start=0,end=0,step=0,method='mean'):
+
+        # Times are in seconds. end=0 means no upper limit. If step is
+        # given, each result is the [time,value] for step seconds
+        # starting at that time.
+
+        if method not in Methods:
+            raise ValueError('Unknown method: %s' % method)
+
+        samples = [(t,v) for t,v in self.samples()
+                   if t>=start and (not end or t<=end)]
+
+        if not step:
+            return [[t,v] for t,v in samples]
+
+        # key -> [count,sum,min,max]
+
+        buckets = {}
+
+        for t,v in samples:
+            key = start+int((t-start)//step)*step
+            if key in buckets:
+                bucket = buckets[key]
+                bucket[0] += 1
+                bucket[1] += v
+                bucket[2] = min(bucket[2],v)
+                bucket[3] = max(bucket[3],v)
+            else:
+                buckets[key] = [1,v,v,v]
+
+        results = []
+
+        for key in sorted(buckets):
+            count,total,low,high = buckets[key]
+            if method=='min':
+                value = low
+            elif method=='max':
+                value = high
+            else:
+                value = total/count
+            results.append([key,value])
+
+        return results
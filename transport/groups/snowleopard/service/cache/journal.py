@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Cache persistence
+#
+#   The cache is kept on disk as a snapshot plus an append-only log
+#   of the puts made since. Both hold a sequence of records:
+#
+#       length  uint32
+#       crc32   uint32
+#       data    pickled (key,value,version,time,ttl,writer)
+#
+#   Each record holds the whole state of an entry, so loading just
+#   replays the snapshot and then the log, with later records
+#   replacing earlier ones. A torn record at the end of the log
+#   (power lost during a write) fails its length or CRC check and it
+#   and anything after it is dropped.
+#
+#   Compacting writes the live entries to a new snapshot (written to
+#   a temporary file, synced and renamed into place) and then
+#   truncates the log. If we stop between the two, the old log is
+#   replayed over the new snapshot on the next load, which ends up
+#   in the same state.
+#
+#   2026-10-19  Initial implementation
+#
+####################################################################
+
+import os
+import zlib
+import struct
+import cPickle
+import logging
+
+FRAME = '!II'
+
+def syncDir(dirname):
+    fd = os.open(dirname,os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def packRecord(record):
+    data = cPickle.dumps(record,cPickle.HIGHEST_PROTOCOL)
+    return struct.pack(FRAME,len(data),zlib.crc32(data) & 0xffffffff)+data
+
+def readRecords(filename):
+
+    # Returns the records and the length of the good part of the file
+
+    records = []
+    offset = 0
+
+    try:
+        data = open(filename,'rb').read()
+    except IOError:
+        return records,offset
+
+    frameSize = struct.calcsize(FRAME)
+
+    while offset+frameSize<=len(data):
+        length,crc = struct.unpack(FRAME,data[offset:offset+frameSize])
+        start = offset+frameSize
+        payload = data[start:start+length]
+        if len(payload)!=length or zlib.crc32(payload) & 0xffffffff!=crc:
+            break
+        try:
+            records.append(cPickle.loads(payload))
+        except Exception:
+            break
+        offset = start+length
+
+    return records,offset
+
+class CacheJournal:
+
+    def __init__(self,path,sync=False,log=logging):
+        self.path       = path
+        self.sync       = sync
+        self.log        = log
+
+        self.snapshotFile   = os.path.join(path,'snapshot')
+        self.logFile        = os.path.join(path,'log')
+
+        self.fp         = None
+        self.logSize    = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def load(self):
+
+        snapshot,length = readRecords(self.snapshotFile)
+        records,length = readRecords(self.logFile)
+
+        if os.path.exists(self.logFile) and \
+           length!=os.path.getsize(self.logFile):
+            self.log.info('Dropping %d bytes from end of cache log' % \
+                (os.path.getsize(self.logFile)-length))
+            fp = open(self.logFile,'r+b')
+            fp.truncate(length)
+            fp.close()
+
+        self.logSize = length
+
+        return snapshot+records
+
+    def open(self):
+        if not self.fp:
+            self.fp = open(self.logFile,'ab')
+
+    def append(self,record):
+
+        self.open()
+
+        data = packRecord(record)
+
+        self.fp.write(data)
+        self.fp.flush()
+
+        if self.sync:
+            os.fsync(self.fp.fileno())
+
+        self.logSize += len(data)
+
+    def compact(self,records):
+
+        tmpFile = self.snapshotFile+'.tmp'
+
+        fp = open(tmpFile,'wb')
+        try:
+            for record in records:
+                fp.write(packRecord(record))
+            fp.flush()
+            os.fsync(fp.fileno())
+        finally:
+            fp.close()
+
+        os.rename(tmpFile,self.snapshotFile)
+        syncDir(self.path)
+
+        self.close()
+
+        fp = open(self.logFile,'wb')
+        os.fsync(fp.fileno())
+        fp.close()
+
+        self.logSize = 0
+
+    def close(self):
+        if self.fp:
+            self.fp.close()
+            self.fp = None
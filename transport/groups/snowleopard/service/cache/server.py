@@ -6,6 +6,57 @@
 #
 #   This service is used to cache values between clients.
 #
+#   Each entry carries a version number, taken from a counter that
+#   is incremented whenever a put changes a value. Clients can
+#   block in wait() until a key is changed instead of polling it:
+#
+#       version = 0
+#       while True:
+#           result = cache.wait('sunsaver',version,60)
+#           if result:
+#               version,value = result
+#               ...
+#
+#   wait() returns [version,value] as soon as the key has a version
+#   newer than the one given, or False on timeout. Waiting clients
+#   hold a request thread in the XML-RPC server, so the timeout is
+#   capped at wait.max. This needs a threaded server (otherwise a
+#   wait would block the put that ends it); if the server found in
+#   XMLRPCServerMixin isn't one, a threading mixin is added to it at
+#   startup, and if no server can be found waits are disabled.
+#
+#   Entries also record when and by whom they were written and can
+#   be given a time to live, either in the put or with a ttl.<key>
+#   setting in the config. Expired entries are dropped the next time
+#   they are looked at and read as missing. get_many, put_many and
+#   snapshot handle several keys in one request.
+#
+#   If persist.path is set, every write is also appended to a log
+#   there, which is compacted into a snapshot once it grows past
+#   persist.compact bytes (see journal.py). The entries are loaded
+#   back on startup, so readers don't have to wait for producers to
+#   sample again after a restart, and are marked as stale in the
+#   snapshot() output until they are next written. Versions carry on
+#   from the restored ones. With persist.sync each write is synced
+#   to disk, otherwise the last few writes can be lost on power
+#   failure (but not when just the service is restarted).
+#
+#   The entries are also published to a memory mapped file at
+#   shm.path, which local clients can read through sharedcache.py
+#   without going through XML-RPC. Publishing is done by its own
+#   thread, which takes a copy of the entries under the lock and
+#   pickles them outside it. Puts only flag that there is something
+#   to publish, so a burst of them is published once, at most every
+#   shm.interval seconds.
+#
+#   Numeric keys can also keep a history of their recent values,
+#   set up with history.<key>: <number of samples>. Every put adds a
+#   sample, even when the value is unchanged. history() returns the
+#   samples for a time range, optionally reduced to the min, max or
+#   mean over fixed steps. Negative times are relative to now:
+#
+#       cache.history('sunsaver.T_amb',-600,0,600)  # 10 minute mean
+#
 #   2009-11-03  Todd Valentic
 #               Initial implementation
 #
@@ -13,12 +64,55 @@
 #               Incorporate config lookup (replaced the separate
 #                   config service).
 #
+#   2026-10-19  Add versioned entries and wait()
+#
+#   2026-10-19  Add get_many, put_many and snapshot. Entries have a
+#                   TTL, timestamp and writer id.
+#
+#   2026-10-19  Persist entries to a snapshot and append log
+#
+#   2026-10-19  Publish entries to shared memory
+#
+#   2026-10-19  Add history rings for numeric keys
+#
+#   2026-10-19  Make sure the XML-RPC server is threaded for wait()
+#
+#   2026-10-19  Publish to shared memory from a separate thread,
+#                   coalescing puts.
+#
 ###################################################################
 
 from Transport  import ProcessClient
 from Transport  import XMLRPCServerMixin
+from Transport.Util import datefunc
+from threading  import Condition, Event, Thread
+from SocketServer import BaseServer, ThreadingMixIn
+from journal    import CacheJournal
+from sharedcache import SharedCacheWriter
+from history    import HistoryRing
 
 import sys
+import time
+
+class Entry:
+
+    def __init__(self,value,version,ttl=0,writer=''):
+        self.value      = value
+        self.version    = version
+        self.time       = time.time()
+        self.ttl        = ttl
+        self.writer     = writer
+        self.stale      = False
+
+    def record(self,key):
+        return (key,self.value,self.version,self.time,self.ttl,self.writer)
+
+    def expired(self,now):
+        return self.ttl and now>self.time+self.ttl
+
+    def info(self):
+        return dict(value=self.value,version=self.version,time=self.time,
+                    ttl=self.ttl,writer=self.writer,stale=self.stale)
 
 class Server(ProcessClient,XMLRPCServerMixin):
 
@@ -30,22 +124,316 @@ class Server(ProcessClient,XMLRPCServerMixin):
         self.register_function(self.put)
         self.register_function(self.list)
         self.register_function(self.lookup)
+        self.register_function(self.version)
+        self.register_function(self.wait)
+        self.register_function(self.getMany,'get_many')
+        self.register_function(self.putMany,'put_many')
+        self.register_function(self.snapshot)
+        self.register_function(self.history)
+
+        self.waitMax = self.getfloat('wait.max',300)
+
+        if not self.makeThreaded():
+            self.log.error('No XML-RPC server found, wait() will not block')
+            self.waitMax = 0
 
         self.cache = {}
+        self.curVersion = 0
+        self.changed = Condition()
+        self.defaultTTL = {}
+        self.histories = {}
+        self.historySize = {}
+
+        self.journal = None
+        self.shared = None
+        self.compactSize = self.getBytes('persist.compact',256*1024)
+
+        persistPath = self.get('persist.path')
+
+        if persistPath:
+            self.journal = CacheJournal(persistPath,
+                                        self.getboolean('persist.sync',False),
+                                        self.log)
+            self.restore()
+
+        sharedPath = self.get('shm.path')
+
+        if sharedPath:
+            self.shared = SharedCacheWriter(sharedPath)
+            self.publishInterval = self.getfloat('shm.interval',0.1)
+            self.publishRequest = Event()
+            self.publish()
+            publisher = Thread(target=self.publisher)
+            publisher.setDaemon(True)
+            publisher.start()
+
+    def makeThreaded(self):
+
+        # Each request needs its own thread for wait(). Returns False
+        # if the mixin's server can't be found.
+
+        for value in vars(self).values():
+            if not isinstance(value,BaseServer):
+                continue
+            if not isinstance(value,ThreadingMixIn):
+                self.log.info('Adding a threading mixin to the XML-RPC server')
+                class ThreadingServer(ThreadingMixIn,value.__class__):
+                    daemon_threads = True
+                value.__class__ = ThreadingServer
+            return True
+
+        return False
+
+    def getTTL(self,key):
+        if key not in self.defaultTTL:
+            ttl = self.getDeltaTime('ttl.%s' % key,0)
+            self.defaultTTL[key] = datefunc.timedelta_as_seconds(ttl)
+        return self.defaultTTL[key]
+
+    def getEntry(self,key,now=None):
+
+        # Expired entries are removed when they are next looked at
+
+        entry = self.cache.get(key)
+
+        if entry and entry.expired(now or time.time()):
+            del self.cache[key]
+            entry = None
+
+        return entry
+
+    def liveEntries(self):
+        now = time.time()
+        entries = {}
+        for key in self.cache.keys():
+            entry = self.getEntry(key,now)
+            if entry:
+                entries[key] = entry
+        return entries
+
+    def restore(self):
+
+        count = 0
+
+        for key,value,version,timestamp,ttl,writer in self.journal.load():
+            entry = Entry(value,version,ttl,writer)
+            entry.time = timestamp
+            entry.stale = True
+            self.cache[key] = entry
+            self.curVersion = max(self.curVersion,version)
+            count += 1
+
+        self.compact()
 
-    def put(self,key,value):
-        self.cache[key]=value
+        self.log.info('Restored %d cache entries from %d records' % \
+            (len(self.cache),count))
+
+    def compact(self):
+        entries = self.liveEntries()
+        self.journal.compact([entry.record(key)
+                              for key,entry in entries.items()])
+
+    def persist(self,key):
+
+        # Called with the lock held. A disk problem shouldn't stop
+        # the cache from working.
+
+        if not self.journal:
+            return
+
+        try:
+            self.journal.append(self.cache[key].record(key))
+            if self.journal.logSize>self.compactSize:
+                self.compact()
+        except:
+            self.log.exception('Problem writing cache log')
+
+    def requestPublish(self):
+
+        # Called with the lock held
+
+        if self.shared:
+            self.publishRequest.set()
+
+    def publisher(self):
+
+        while True:
+            self.publishRequest.wait()
+            self.publishRequest.clear()
+            self.publish()
+            time.sleep(self.publishInterval)
+
+    def publish(self):
+
+        # Only the copy is made with the lock held
+
+        self.changed.acquire()
+        try:
+            entries = dict([(key,(entry.version,entry.time,entry.ttl,
+                                  entry.writer,entry.stale,entry.value))
+                            for key,entry in self.liveEntries().items()])
+        finally:
+            self.changed.release()
+
+        try:
+            self.shared.publish(entries)
+        except:
+            self.log.exception('Problem publishing to shared memory')
+
+    def getHistory(self,key):
+        if key not in self.historySize:
+            self.historySize[key] = self.getint('history.%s' % key,0)
+        if self.historySize[key] and key not in self.histories:
+            self.histories[key] = HistoryRing(self.historySize[key])
+        return self.histories.get(key)
+
+    def addSample(self,key,value,timestamp):
+        ring = self.getHistory(key)
+        if ring and isinstance(value,(int,float)):
+            ring.append(timestamp,value)
+
+    def store(self,key,value,ttl,writer):
+
+        # Called with the lock held
+
+        ttl = ttl or self.getTTL(key)
+        entry = self.getEntry(key)
+
+        if entry and entry.value==value:
+            # Rewriting the same value doesn't wake anyone up
+            entry.time = time.time()
+            entry.ttl = ttl
+            entry.writer = writer
+            entry.stale = False
+            self.persist(key)
+            self.addSample(key,value,entry.time)
+            return False
+
+        self.curVersion += 1
+        self.cache[key] = Entry(value,self.curVersion,ttl,writer)
+        self.persist(key)
+        self.addSample(key,value,self.cache[key].time)
+
+        return True
+
+    def put(self,key,value,ttl=0,writer=''):
+        self.changed.acquire()
+        try:
+            if self.store(key,value,ttl,writer):
+                self.changed.notifyAll()
+            self.requestPublish()
+        finally:
+            self.changed.release()
+        return True
+
+    def putMany(self,values,ttl=0,writer=''):
+        self.changed.acquire()
+        try:
+            changed = [self.store(key,value,ttl,writer)
+                       for key,value in values.items()]
+            if True in changed:
+                self.changed.notifyAll()
+            self.requestPublish()
+        finally:
+            self.changed.release()
         return True
 
     def getValue(self,key):
-        return self.cache[key]
+        self.changed.acquire()
+        try:
+            entry = self.getEntry(key)
+            if not entry:
+                raise KeyError(key)
+            return entry.value
+        finally:
+            self.changed.release()
+
+    def getMany(self,keys):
+        # Missing and expired keys are left out
+        self.changed.acquire()
+        try:
+            now = time.time()
+            entries = [(key,self.getEntry(key,now)) for key in keys]
+            return dict([(key,entry.value) for key,entry in entries if entry])
+        finally:
+            self.changed.release()
+
+    def snapshot(self,keys=[]):
+        # Values and metadata for keys (or everything)
+        self.changed.acquire()
+        try:
+            entries = self.liveEntries()
+            if keys:
+                keys = set(keys)
+                entries = dict([(k,v) for k,v in entries.items() if k in keys])
+            return dict([(key,entry.info()) for key,entry in entries.items()])
+        finally:
+            self.changed.release()
+
+    def history(self,key,start=0,end=0,step=0,method='mean'):
+
+        # [[time,value],...] for key, see HistoryRing.query()
+
+        now = time.time()
+
+        if start<0:
+            start = now+start
+        if end<0:
+            end = now+end
+
+        self.changed.acquire()
+        try:
+            ring = self.getHistory(key)
+            if not ring:
+                raise KeyError('No history kept for %s' % key)
+            return ring.query(start,end,step,method)
+        finally:
+            self.changed.release()
 
     def list(self):
-        return self.cache.keys()
+        self.changed.acquire()
+        try:
+            return self.liveEntries().keys()
+        finally:
+            self.changed.release()
 
     def lookup(self,keyword):
         return self.get(keyword)
 
+    def version(self,key):
+        # 0 if the key is not set
+        self.changed.acquire()
+        try:
+            entry = self.getEntry(key)
+            return entry and entry.version or 0
+        finally:
+            self.changed.release()
+
+    def wait(self,key,since=0,timeout=60):
+
+        # A version newer than any we have handed out is from before a
+        # restart, so treat it as out of date rather than waiting on it.
+
+        timeout = max(0,min(timeout,self.waitMax))
+        endTime = time.time()+timeout
+
+        self.changed.acquire()
+
+        try:
+            if since>self.curVersion:
+                since = 0
+
+            while True:
+                entry = self.getEntry(key)
+                if entry and entry.version>since:
+                    return [entry.version,entry.value]
+                remaining = endTime-time.time()
+                if remaining<=0:
+                    return False
+                self.changed.wait(remaining)
+
+        finally:
+            self.changed.release()
+
 if __name__ == '__main__':
     Server(sys.argv).run()
-
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Outbound file catalog
+#
+#   Keeps an index of the files matching each group's filespecs
+#   (path, size, mtime and the groups it belongs to) so that the
+#   transfer doesn't have to glob and stat every outbound file
+#   while the modem is online.
+#
+#   Changes are picked up with inotify when pyinotify is installed.
+#   Otherwise the directories are polled and only the ones whose
+#   mtime has changed are listed again, with just the new names
+#   being stat'd. Writing to a file doesn't change the directory
+#   mtime, so files that were less than settle seconds old when
+#   last seen are stat'd again on each poll to catch ones still
+#   being written. Later changes to an existing file are only seen
+#   with inotify; the sizes are just used for scheduling, spooling
+#   reads the actual file.
+#
+#   2026-10-19  Initial implementation
+#
+####################################################################
+
+from threading import Thread, RLock, Event
+
+import os
+import stat
+import glob
+import time
+import fnmatch
+import logging
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+def matchName(name,pattern):
+    # Like glob, wildcards don't match a leading dot
+    if name.startswith('.') and not pattern.startswith('.'):
+        return False
+    return fnmatch.fnmatch(name,pattern)
+
+class FileCatalog(Thread):
+
+    def __init__(self,groups,interval=30,settle=60,backend='auto',
+                 log=logging):
+        Thread.__init__(self)
+        self.setDaemon(True)
+
+        self.groups     = groups
+        self.interval   = interval
+        self.settle     = settle
+        self.log        = log
+
+        self.lock       = RLock()
+        self.stopping   = Event()
+
+        self.files      = {}    # path -> (size,mtime,groups)
+        self.dirFiles   = {}    # dirname -> set of paths
+        self.dirState   = {}    # dirname -> (mtime,time scanned)
+        self.recent     = set() # paths to check again (polling)
+
+        # (dir pattern,name pattern,group name) for each filespec
+
+        self.specs = []
+
+        for group in groups:
+            for filespec in group.filespecs:
+                dirname,pattern = os.path.split(filespec)
+                self.specs.append((dirname,pattern,group.name))
+
+        if backend=='auto':
+            backend = pyinotify and 'inotify' or 'poll'
+
+        if backend=='inotify' and pyinotify is None:
+            self.log.error('pyinotify is not available, polling instead')
+            backend = 'poll'
+
+        self.backend = backend
+
+        if self.backend=='inotify':
+            self.watches = pyinotify.WatchManager()
+            self.notifier = pyinotify.Notifier(self.watches,
+                                               self.processEvent)
+
+        self.log.info('File catalog: %s' % self.backend)
+
+    #-- Index -------------------------------------------------------------
+
+    def membership(self,path):
+        dirname,name = os.path.split(path)
+        return [group for dirspec,pattern,group in self.specs
+                if matchName(name,pattern) and fnmatch.fnmatch(dirname,dirspec)]
+
+    def update(self,path):
+
+        self.lock.acquire()
+
+        try:
+            groups = self.membership(path)
+
+            try:
+                info = os.stat(path)
+            except OSError:
+                groups = None
+
+            if not groups or not stat.S_ISREG(info.st_mode):
+                self.remove(path)
+                return
+
+            self.files[path] = (info.st_size,info.st_mtime,groups)
+            self.dirFiles.setdefault(os.path.dirname(path),set()).add(path)
+
+            if info.st_mtime>time.time()-self.settle:
+                self.recent.add(path)
+            else:
+                self.recent.discard(path)
+
+        finally:
+            self.lock.release()
+
+    def remove(self,path):
+
+        self.lock.acquire()
+
+        try:
+            self.files.pop(path,None)
+            self.dirFiles.get(os.path.dirname(path),set()).discard(path)
+            self.recent.discard(path)
+        finally:
+            self.lock.release()
+
+    def directories(self):
+        dirs = set()
+        for dirspec,pattern,group in self.specs:
+            dirs.update([x for x in glob.glob(dirspec) if os.path.isdir(x)])
+        return dirs
+
+    def scanDir(self,dirname):
+
+        # Only new names are stat'd; names that are gone are dropped
+
+        try:
+            names = set([os.path.join(dirname,x) for x in os.listdir(dirname)])
+        except OSError:
+            names = set()
+
+        known = self.dirFiles.get(dirname,set())
+
+        for path in known.difference(names):
+            self.remove(path)
+
+        for path in names.difference(known):
+            self.update(path)
+
+    def restatRecent(self):
+        for path in list(self.recent):
+            self.update(path)
+
+    def dropDir(self,dirname):
+        for path in list(self.dirFiles.get(dirname,[])):
+            self.remove(path)
+        self.dirFiles.pop(dirname,None)
+        self.dirState.pop(dirname,None)
+
+    #-- Change detection --------------------------------------------------
+
+    def poll(self):
+
+        dirs = self.directories()
+
+        for dirname in set(self.dirState.keys()).difference(dirs):
+            self.dropDir(dirname)
+
+        for dirname in dirs:
+
+            try:
+                mtime = os.stat(dirname).st_mtime
+            except OSError:
+                self.dropDir(dirname)
+                continue
+
+            # Directory mtimes can be coarse (2s on FAT), so anything
+            # changed around the last scan is listed again.
+
+            lastMtime,scanTime = self.dirState.get(dirname,(None,0))
+
+            if mtime!=lastMtime or mtime>=scanTime-2:
+                self.dirState[dirname] = (mtime,time.time())
+                self.scanDir(dirname)
+
+        self.restatRecent()
+
+    def addWatches(self):
+
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | \
+               pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM | \
+               pyinotify.IN_DELETE | pyinotify.IN_DELETE_SELF
+
+        for dirname in self.directories():
+            if dirname not in self.dirState:
+                self.watches.add_watch(dirname,mask)
+                self.dirState[dirname] = (None,time.time())
+                self.scanDir(dirname)
+
+    def processEvent(self,event):
+
+        if event.mask & pyinotify.IN_DELETE_SELF:
+            self.dropDir(event.path)
+        elif event.mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+            self.remove(event.pathname)
+        elif not event.mask & pyinotify.IN_ISDIR:
+            self.update(event.pathname)
+
+    def readEvents(self,timeout):
+
+        # timeout in seconds
+
+        if self.notifier.check_events(int(timeout*1000)):
+            self.lock.acquire()
+            try:
+                self.notifier.read_events()
+                self.notifier.process_events()
+            finally:
+                self.lock.release()
+
+    #-- Public interface --------------------------------------------------
+
+    def refresh(self):
+
+        # Bring the catalog up to date now
+
+        self.lock.acquire()
+
+        try:
+            if self.backend=='inotify':
+                self.addWatches()
+                self.readEvents(0)
+            else:
+                self.poll()
+        finally:
+            self.lock.release()
+
+    def listFiles(self,group):
+
+        # Sorted list of (path,size,mtime) for the files in group
+
+        self.lock.acquire()
+
+        try:
+            return sorted([(path,size,mtime)
+                           for path,(size,mtime,groups) in self.files.items()
+                           if group.name in groups])
+        finally:
+            self.lock.release()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+
+        while not self.stopping.isSet():
+
+            try:
+                if self.backend=='inotify':
+                    self.refresh()
+                    self.readEvents(self.interval)
+                else:
+                    self.refresh()
+                    self.stopping.wait(self.interval)
+            except:
+                self.log.exception('Problem updating file catalog')
+                self.stopping.wait(self.interval)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Delta base store
+#
+#   Keeps the version of each logical file that the ground has
+#   acknowledged, for the exchange server to send rdeltas against,
+#   along with the versions staged and posted since.
+#
+#   2026-10-19  Moved out of server.py. sent() can be called again
+#                   for the same staged versions (a resumed spool).
+#
+####################################################################
+
+from ConfigParser   import RawConfigParser
+from threading      import Lock
+
+import os
+import re
+import md5
+
+StagedName = re.compile(r'^[0-9a-f]{32}\.(\d+\.\d+|new)$')
+
+def getSeq(config,section):
+    # Bases from before seq was recorded count as oldest
+    if config.has_option(section,'seq'):
+        return config.getint(section,'seq')
+    return 0
+
+class DeltaStore:
+
+    # Versions of each logical file the ground has acknowledged,
+    # which deltas are made against. Each file's new version is
+    # staged under its own name when it is spooled, becomes pending
+    # once posted and replaces the base when the ground acknowledges
+    # it by MD5. Pending versions older than an acknowledged one are
+    # dropped.
+    #
+    #   index.conf      [<hash of key>] key, md5, deltas, seq
+    #   pending.conf    [<staged name>] key, md5, mode, seq
+
+    def __init__(self,path,maxSize,log):
+        self.path       = path
+        self.maxSize    = maxSize
+        self.log        = log
+        self.indexFile  = os.path.join(path,'index.conf')
+        self.pendingFile= os.path.join(path,'pending.conf')
+        self.lock       = Lock()
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def section(self,key):
+        return md5.new(key).hexdigest()
+
+    def filename(self,name):
+        return os.path.join(self.path,name)
+
+    def loadConfig(self,filename):
+        config = RawConfigParser()
+        config.read(filename)
+        return config
+
+    def saveConfig(self,filename,config):
+        output = open(filename+'.new','w')
+        config.write(output)
+        output.close()
+        os.rename(filename+'.new',filename)
+
+    def get(self,key):
+
+        # The acknowledged version of key or None
+
+        filename = self.filename(self.section(key))
+
+        if os.path.exists(filename):
+            return open(filename,'rb').read()
+
+        return None
+
+    def getStaged(self,name):
+        return open(self.filename(name),'rb').read()
+
+    def numDeltas(self,key):
+        self.lock.acquire()
+        try:
+            index = self.loadConfig(self.indexFile)
+            section = self.section(key)
+            if not index.has_section(section):
+                return 0
+            return index.getint(section,'deltas')
+        finally:
+            self.lock.release()
+
+    def stagedName(self,key,id,index):
+        return '%s.%d.%d' % (self.section(key),id,index)
+
+    def stage(self,name,data):
+        output = open(self.filename(name),'wb')
+        output.write(data)
+        output.close()
+
+    def discard(self,name):
+        filename = self.filename(name)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def discardStaged(self,keep=[]):
+
+        # Staged versions that are neither in the spool nor pending
+        # (and any left in the older <hash>.new form)
+
+        self.lock.acquire()
+        try:
+            keep = set(keep).union(self.loadConfig(self.pendingFile).sections())
+            for name in os.listdir(self.path):
+                if StagedName.match(name) and name not in keep:
+                    os.remove(self.filename(name))
+        finally:
+            self.lock.release()
+
+    def nextSeq(self,index,pending):
+        seqs = [getSeq(config,section)
+                for config in [index,pending]
+                for section in config.sections()]
+        return max(seqs+[0])+1
+
+    def sent(self,staged):
+
+        # staged versions have been posted, wait for the ground
+
+        if not staged:
+            return
+
+        self.lock.acquire()
+        try:
+            index = self.loadConfig(self.indexFile)
+            pending = self.loadConfig(self.pendingFile)
+            seq = self.nextSeq(index,pending)
+
+            for mode,name,checksum,key in staged:
+                if not os.path.exists(self.filename(name)):
+                    continue
+                # Posted again after a restart, keep the first seq
+                if pending.has_section(name) and \
+                   pending.get(name,'md5')==checksum:
+                    continue
+                if not pending.has_section(name):
+                    pending.add_section(name)
+                pending.set(name,'key',key)
+                pending.set(name,'md5',checksum)
+                pending.set(name,'mode',mode)
+                pending.set(name,'seq',str(seq))
+                seq += 1
+
+            self.enforceLimit(index,pending)
+            self.saveConfig(self.pendingFile,pending)
+            self.saveConfig(self.indexFile,index)
+        finally:
+            self.lock.release()
+
+    def acknowledge(self,checksum):
+
+        # Returns True if checksum was a pending version
+
+        self.lock.acquire()
+        try:
+            index = self.loadConfig(self.indexFile)
+            pending = self.loadConfig(self.pendingFile)
+
+            names = [name for name in pending.sections()
+                     if pending.get(name,'md5')==checksum]
+
+            for name in names:
+                if pending.has_section(name):
+                    self.commit(name,index,pending)
+
+            self.saveConfig(self.pendingFile,pending)
+            self.saveConfig(self.indexFile,index)
+
+            return len(names)>0
+        finally:
+            self.lock.release()
+
+    def commit(self,name,index,pending):
+
+        key = pending.get(name,'key')
+        seq = pending.getint(name,'seq')
+        section = self.section(key)
+
+        if index.has_section(section) and getSeq(index,section)>seq:
+            # A later version was acknowledged first
+            self.removePending(name,pending)
+            return
+
+        if pending.get(name,'mode')=='delta' and index.has_section(section):
+            deltas = index.getint(section,'deltas')+1
+        else:
+            deltas = 0
+
+        if not index.has_section(section):
+            index.add_section(section)
+
+        index.set(section,'key',key)
+        index.set(section,'md5',pending.get(name,'md5'))
+        index.set(section,'deltas',str(deltas))
+        index.set(section,'seq',str(seq))
+
+        os.rename(self.filename(name),self.filename(section))
+        pending.remove_section(name)
+
+        self.log.info('    - delta base for %s acknowledged' % key)
+
+        # Versions sent before this one are no use as a base now
+
+        for other in pending.sections():
+            if pending.get(other,'key')==key and \
+               pending.getint(other,'seq')<seq:
+                self.removePending(other,pending)
+
+        self.enforceLimit(index,pending)
+
+    def removePending(self,name,pending):
+        self.discard(name)
+        pending.remove_section(name)
+
+    def enforceLimit(self,index,pending):
+
+        # Remove the oldest bases and pending versions until we are
+        # under maxSize
+
+        entries = []
+        total = 0
+
+        for config in [index,pending]:
+            for section in config.sections():
+                filename = self.filename(section)
+                if not os.path.exists(filename):
+                    config.remove_section(section)
+                    continue
+                size = os.path.getsize(filename)
+                entries.append((getSeq(config,section),size,section,config))
+                total += size
+
+        entries.sort()
+
+        while total>self.maxSize and entries:
+            seq,size,section,config = entries.pop(0)
+            self.log.info('    - removing delta version of %s' % \
+                            config.get(section,'key'))
+            os.remove(self.filename(section))
+            config.remove_section(section)
+            total -= size
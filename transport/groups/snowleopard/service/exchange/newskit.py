@@ -31,19 +31,41 @@
 #               Time from news server was parsed incorrectly in
 #               self.datetime
 #
+#   2026-10-19  Stream articles to the server. Attachments are
+#                   encoded from disk as the lines are sent
+#                   rather than building the message in memory.
+#
+#   2026-10-19  Pipelined article retrieval. NewsServer.articles()
+#                   keeps a window of ARTICLE commands outstanding
+#                   so each fetch doesn't wait a full round trip.
+#
+#   2026-10-19  Inbound triage. NewsPoller can pass the XOVER data for
+#                   the unread articles to a triage function, which
+#                   picks the ones to fetch now, defer or skip.
+#                   Deferred article numbers are kept in a file next
+#                   to the last read file.
+#
+#   2026-10-19  Optional yEnc encoding of attachments (encoding=yenc
+#                   in post), sent as Content-Transfer-Encoding
+#                   x-yenc.
+#
+#   2026-10-19  NewsPoller counts the article bytes read (bytesRead).
+#
+#   2026-10-19  Shut the socket down in close() so that a read blocked
+#                   in another thread returns right away.
+#
 ####################################################################
 
 from Transport.Util.dateutil    import parser
 
 from email.MIMEText             import MIMEText
-from email.MIMEMultipart        import MIMEMultipart
-from email.MIMEImage            import MIMEImage
-from email.MIMEAudio            import MIMEAudio
 from email.MIMEBase             import MIMEBase
 from email.Generator            import Generator
-from email                      import Encoders
+from email.Generator            import _make_boundary
 
 import os
+import base64
+import socket
 import nntplib
 import logging
 import mimetypes
@@ -51,6 +73,7 @@ import email
 import cStringIO
 import fnmatch
 import datetime
+import yenc
 
 #########################################################################
 #
@@ -79,6 +102,10 @@ class NewsServer:
         if self.server:
             try:
                 #self.server.quit()
+                self.server.sock.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+            try:
                 self.server.sock.close()
             except:
                 pass
@@ -125,9 +152,57 @@ class NewsServer:
     def body(self,*args,**kw):
         return self.sync('body',*args,**kw)
 
+    def xover(self,*args,**kw):
+        return self.sync('xover',*args,**kw)
+
     def quit(self,*args,**kw):
         return self.close()
 
+    #-- Pipelined retrieval -------------------------------------------
+
+    def articles(self,nums,window=4):
+
+        # Generator over (num,lines) for each article number in nums,
+        # in order. Up to window ARTICLE commands are sent ahead of
+        # the responses being read. Articles that no longer exist on
+        # the server (4xx other than 400) are returned as (num,None).
+        #
+        # Any other error leaves the connection in an unknown state
+        # with responses still in flight, so it is closed before the
+        # error is raised. The same happens if the caller stops early.
+
+        if not self.server:
+            self.open()
+
+        server = self.server
+        nums = list(nums)
+        pending = []
+
+        try:
+            while nums or pending:
+
+                while nums and len(pending)<window:
+                    num = nums.pop(0)
+                    server.putcmd('ARTICLE %s' % num)
+                    pending.append(num)
+
+                num = pending.pop(0)
+
+                try:
+                    resp,lines = server.getlongresp()
+                except nntplib.NNTPTemporaryError,desc:
+                    if str(desc).startswith('400'):
+                        raise
+                    self.log.error('Problem retrieving article %s: %s' % \
+                                    (num,desc))
+                    lines = None
+
+                yield num,lines
+
+        finally:
+            if pending:
+                self.close()
+
     #-- Extended functions --------------------------------------------
 
     def groupExists(self,newsgroup):
@@ -216,6 +291,22 @@ class NewsBase:
 #
 #########################################################################
 
+class ArticleReader:
+
+    # File-like object for NNTP.post(), which only calls readline().
+
+    def __init__(self,lines):
+        self.lines      = iter(lines)
+        self.numBytes   = 0
+
+    def readline(self):
+        try:
+            line = self.lines.next()
+        except StopIteration:
+            return ''
+        self.numBytes += len(line)
+        return line
+
 class NewsPoster(NewsBase):
 
     def __init__(self,*args,**kw):
@@ -225,6 +316,11 @@ class NewsPoster(NewsBase):
         self.setHeader('Subject','no subject')
         self.setHeader('From','transport@transport.sri.com')
         self.setEnable(True)
+        self.setBlockSize(57*1024)
+
+    def setBlockSize(self,blockSize):
+        # Multiple of 57 keeps the base64 lines at 76 characters
+        self.blockSize = blockSize
 
     def setEnable(self,flag):
         self.enabled = flag
@@ -251,36 +347,90 @@ class NewsPoster(NewsBase):
         for key,value in headers.items():
             msg[key]=value
 
-    def addFile(self,msg,filename):
+    def partHeaders(self,filename,transferEncoding='base64'):
 
         ctype,encoding = mimetypes.guess_type(filename)
         if ctype is None or encoding is not None:
             ctype = 'application/octet-stream'
         maintype,subtype = ctype.split('/',1)
+
         if maintype=='text':
-            fp = open(filename)
-            part = MIMEText(fp.read(),_subtype=subtype)
-            fp.close()
-        elif maintype == 'image':
-            fp = open(filename, 'rb')
-            part = MIMEImage(fp.read(), _subtype=subtype)
-            fp.close()
-        elif maintype == 'audio':
-            fp = open(filename, 'rb')
-            part = MIMEAudio(fp.read(), _subtype=subtype)
-            fp.close()
+            part = MIMEBase(maintype,subtype,charset='us-ascii')
+            part['Content-Transfer-Encoding'] = '7bit'
+        elif transferEncoding=='yenc':
+            part = MIMEBase(maintype,subtype)
+            part['Content-Transfer-Encoding'] = 'x-yenc'
         else:
-            fp = open(filename, 'rb')
-            part = MIMEBase(maintype, subtype)
-            part.set_payload(fp.read())
-            fp.close()
-            Encoders.encode_base64(part)
+            part = MIMEBase(maintype,subtype)
+            part['Content-Transfer-Encoding'] = 'base64'
 
         basename = os.path.basename(filename)
         part.add_header('Content-Disposition','attachment',filename=basename)
-        msg.attach(part)
 
-    def post(self,filenames=[],text=None,date=None,headers={}):
+        return maintype,part
+
+    def fileLines(self,filename,transferEncoding='base64'):
+
+        maintype,part = self.partHeaders(filename,transferEncoding)
+
+        for line in self.messageLines(part):
+            yield line
+
+        if maintype=='text':
+            fp = open(filename)
+            for line in fp:
+                yield line
+            yield '\n'
+        elif transferEncoding=='yenc':
+            fp = open(filename,'rb')
+            basename = os.path.basename(filename)
+            size = os.path.getsize(filename)
+            for line in yenc.encodeFile(fp,basename,size,self.blockSize):
+                yield line
+        else:
+            fp = open(filename,'rb')
+            while True:
+                data = fp.read(self.blockSize)
+                if not data:
+                    break
+                for line in base64.encodestring(data).splitlines(True):
+                    yield line
+
+        fp.close()
+
+    def messageLines(self,msg):
+        buffer = cStringIO.StringIO()
+        Generator(buffer,mangle_from_=False).flatten(msg)
+        return buffer.getvalue().splitlines(True)
+
+    def articleLines(self,filenames,text,date,headers,encoding):
+
+        # Equivalent to flattening a MIMEMultipart message, but the
+        # attachments are only read from disk as the lines are sent.
+
+        boundary = _make_boundary()
+
+        msg = MIMEBase('multipart','mixed',boundary=boundary)
+        msg.set_payload('')
+        self.addHeaders(msg,date,headers)
+
+        for line in self.messageLines(msg):
+            yield line
+
+        if text is not None:
+            yield text+'\n'
+
+        for filename in filenames:
+            yield '--%s\n' % boundary
+            for line in self.fileLines(filename,encoding):
+                yield line
+
+        yield '--%s--\n' % boundary
+
+    def post(self,filenames=[],text=None,date=None,headers={},
+             encoding='base64'):
+
+        # encoding is base64 or yenc for binary attachments
 
         if not self.enabled:
             return
@@ -290,27 +440,16 @@ class NewsPoster(NewsBase):
 
         if not filenames:
             msg = MIMEText(text)
-
+            self.addHeaders(msg,date,headers)
+            lines = self.messageLines(msg)
         else:
-            msg = MIMEMultipart()
-            msg.preamble=text
-            msg.epilogue=''
+            lines = self.articleLines(filenames,text,date,headers,encoding)
 
-            for filename in filenames:
-                self.addFile(msg,filename)
+        article = ArticleReader(lines)
 
-        self.addHeaders(msg,date,headers)
+        self.server.post(article)
 
-        buffer = cStringIO.StringIO()
-        Generator(buffer,mangle_from_=False).flatten(msg)
-
-        buffer.seek(0,2)
-        numBytes = buffer.tell()
-        buffer.seek(0)
-
-        self.server.post(buffer)
-
-        return numBytes
+        return article.numBytes
 
 #########################################################################
 #
@@ -368,6 +507,10 @@ class NewsPoller(NewsBase):
         self.setDebug(False)
         self.setSingleShot(False)
         self.setStopFunc(self.defaultStop)
+        self.setWindow(1)
+        self.setTriage(None)
+
+        self.bytesRead = 0
 
     def setDebug(self,flag):
         self.debug=flag
@@ -381,6 +524,15 @@ class NewsPoller(NewsBase):
     def setStopFunc(self,func):
         self.stop = func
 
+    def setWindow(self,window):
+        self.window = max(1,window)
+
+    def setTriage(self,func):
+        # func(overviews) -> (fetch,defer), lists of article numbers.
+        # Articles in neither list are skipped (marked read without
+        # being downloaded).
+        self.triage = func
+
     def defaultStop(self):
         return False
 
@@ -390,9 +542,30 @@ class NewsPoller(NewsBase):
     def loadLastRead(self):
         return int(open(self.group).readline())
 
+    def advanceLastRead(self,articleNum):
+        # Fetching a deferred article must not move last read back
+        try:
+            if articleNum<=self.loadLastRead():
+                return
+        except:
+            pass
+        self.saveLastRead(articleNum)
+
     def markMessageRead(self,message):
         num = message['XRef'].split(':')[1]
-        self.saveLastRead(num)
+        self.advanceLastRead(int(num))
+
+    def saveDeferred(self,articleNums):
+        output = open(self.group+'.deferred','w')
+        for num in sorted(articleNums):
+            print >> output,num
+        output.close()
+
+    def loadDeferred(self):
+        try:
+            return [int(x) for x in open(self.group+'.deferred').read().split()]
+        except:
+            return []
 
     def markRead(self,msgcount=1):
 
@@ -472,27 +645,154 @@ class NewsPoller(NewsBase):
 
         self.log.info('    - elapsed: %s' % elapsed)
 
+        return self.parseMessage(article)
+
+    def parseMessage(self,article):
+
+        # Article lines as sent, with CRLF
+        self.bytesRead += sum([len(x)+2 for x in article])
+
         try:
             return email.message_from_string('\n'.join(article))
         except:
             self.log.exception('Problem parsing message body')
             return None
 
-    def unreadMessages(self):
+    def fetchMessages(self,articleNums):
 
-        for articleNumber in self.unreadArticleNums():
+        # Pipelined version of getMessage(). Stops at the first
+        # failure, so everything before it has been returned.
+
+        starttime = datetime.datetime.now()
+        articles = self.server.articles(articleNums,self.window)
+
+        try:
+            for num,article in articles:
+                self.log.debug('  retrieved article number %s' % num)
+                if article is None:
+                    yield num,None
+                else:
+                    yield num,self.parseMessage(article)
+        except:
+            self.log.exception('Problem retrieving articles')
+        finally:
+            articles.close()
+
+        elapsed = datetime.datetime.now()-starttime
+
+        self.log.info('    - elapsed: %s' % elapsed)
+
+    def retrieveMessages(self,articleNums):
+
+        if self.window>1:
+            for articleNumber,msg in self.fetchMessages(articleNums):
+                yield articleNumber,msg
+            return
+
+        for articleNumber in articleNums:
 
             try:
                 msg = self.getMessage(articleNumber)
             except:
                 break
 
+            yield articleNumber,msg
+
+    def overview(self,articleNums):
+
+        # XOVER data for articleNums, one request for each contiguous
+        # range. Returns None if the server doesn't support it.
+
+        ranges = []
+
+        for num in sorted(articleNums):
+            if ranges and num==ranges[-1][1]+1:
+                ranges[-1][1] = num
+            else:
+                ranges.append([num,num])
+
+        overviews = []
+
+        for first,last in ranges:
+            try:
+                resp,entries = self.server.xover(str(first),str(last))
+            except nntplib.NNTPError,desc:
+                self.log.error('  overview not available: %s' % desc)
+                return None
+
+            for num,subject,poster,date,msgid,refs,size,lines in entries:
+                overviews.append(dict(num=int(num),subject=subject,
+                                      poster=poster,date=date,id=msgid,
+                                      size=int(size or 0)))
+
+        overviews.sort(key=lambda x: x['num'])
+
+        return overviews
+
+    def triageArticles(self,articleNums):
+
+        # Returns the article numbers to fetch now and the set of
+        # deferred ones that are still outstanding.
+
+        deferred = self.loadDeferred()
+
+        overviews = self.overview(deferred+articleNums)
+
+        if overviews is None:
+            return sorted(deferred+articleNums),set(deferred)
+
+        fetch,defer = self.triage(overviews)
+
+        # Previously deferred articles stay on the list until they
+        # have been fetched. Ones no longer on the server are dropped.
+
+        present = set([x['num'] for x in overviews])
+        pending = set(defer).union(set(fetch).intersection(deferred))
+        pending.intersection_update(present)
+
+        self.saveDeferred(pending)
+
+        numSkipped = len(present)-len(fetch)-len(defer)
+
+        self.log.info('    triage: fetch %d, defer %d, skip %d' % \
+                        (len(fetch),len(defer),numSkipped))
+
+        return sorted(fetch),pending
+
+    def unreadMessages(self):
+
+        articleNums = self.unreadArticleNums()
+        pending = set()
+
+        if articleNums:
+            lastNum = articleNums[-1]
+        else:
+            lastNum = None
+
+        if self.triage:
+            articleNums,pending = self.triageArticles(articleNums)
+
+        handled = 0
+
+        for articleNumber,msg in self.retrieveMessages(articleNums):
+
+            handled += 1
+
+            if articleNumber in pending:
+                pending.discard(articleNumber)
+                self.saveDeferred(pending)
+
             if not msg:
-                self.saveLastRead(articleNumber)
+                self.advanceLastRead(articleNumber)
                 continue
 
             yield msg
 
+        # Skipped and deferred articles after the last one fetched
+
+        if lastNum is not None and handled==len(articleNums):
+            self.advanceLastRead(lastNum)
+
 
     # These next two methods might be better in client code....
 
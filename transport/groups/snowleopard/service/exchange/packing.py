@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Fileset packing
+#
+#   Splits a group's outbound files into filesets (one article
+#   each) of at most maxSize bytes and maxFiles files. A value of
+#   0 means no limit.
+#
+#   sequential  Files stay in sorted (time) order and each fileset
+#               is filled until the next file won't fit. This is
+#               the fewest filesets possible when the order must
+#               be kept, but leaves them part full when file sizes
+#               vary.
+#
+#   ffd         First fit decreasing. Files are placed largest
+#               first into the first fileset with room. The files
+#               in each fileset are returned in sorted order and
+#               the filesets are ordered by their oldest file, so
+#               the scheduler still sends older data first.
+#
+#   A file larger than maxSize always gets a fileset of its own.
+#
+#   2026-10-19  Initial implementation
+#
+####################################################################
+
+Methods = ['sequential','ffd']
+
+def packSequential(files,sizes,maxSize=0,maxFiles=0):
+
+    result   = []
+    curSize  = 0
+    curFiles = []
+
+    for filename in files:
+        filesize = sizes[filename]
+
+        if maxSize and curSize+filesize>maxSize:
+            if curFiles:
+                result.append(curFiles)
+            curSize  = 0
+            curFiles = []
+
+        curSize+=filesize
+        curFiles.append(filename)
+
+        if maxFiles and len(curFiles)==maxFiles:
+            result.append(curFiles)
+            curSize  = 0
+            curFiles = []
+
+    if curFiles:
+        result.append(curFiles)
+
+    return result
+
+def packFFD(files,sizes,maxSize=0,maxFiles=0):
+
+    if not maxSize:
+        return packSequential(files,sizes,maxSize,maxFiles)
+
+    order = dict([(filename,index) for index,filename in enumerate(files)])
+    bins = []
+
+    # Open bins with their free space, kept in creation order. A bin
+    # is closed once it is full or can't take even the smallest file.
+
+    openBins = []
+    smallest = min([sizes[x] for x in files] or [0])
+
+    for filename in sorted(files,key=lambda x: (-sizes[x],order[x])):
+        filesize = sizes[filename]
+
+        for index,entry in enumerate(openBins):
+            if entry[0]>=filesize:
+                break
+        else:
+            entry = [maxSize,[]]
+            bins.append(entry)
+            openBins.append(entry)
+            index = len(openBins)-1
+
+        entry[0] -= filesize
+        entry[1].append(filename)
+
+        if entry[0]<smallest or (maxFiles and len(entry[1])==maxFiles):
+            del openBins[index]
+
+    result = [sorted(files,key=order.get) for space,files in bins]
+    result.sort(key=lambda x: order[x[0]])
+
+    return result
+
+def partition(files,sizes,maxSize=0,maxFiles=0,method='sequential'):
+
+    if method=='ffd':
+        return packFFD(files,sizes,maxSize,maxFiles)
+
+    return packSequential(files,sizes,maxSize,maxFiles)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Fileset packing simulation
+#
+#   Compares the packing methods in packing.py over real directory
+#   listings. Each argument is either a glob pattern or a listing
+#   file (-l) with "size path" lines, for example from
+#
+#       find /transmit/outbound -type f -printf '%s %p\n'
+#
+#   Files are grouped by directory, as the exchange groups are, and
+#   the number of articles, total bytes including the estimated
+#   per-article overhead (MIME and NNTP headers) and the mean fill
+#   of each article are reported for each method.
+#
+#   2026-10-19  Initial implementation
+#
+####################################################################
+
+import os
+import sys
+import glob
+import optparse
+
+import packing
+
+def readListing(filename):
+    sizes = {}
+    for line in open(filename):
+        fields = line.strip().split(None,1)
+        if len(fields)==2:
+            sizes[fields[1]] = int(fields[0])
+    return sizes
+
+def readGlob(pattern):
+    sizes = {}
+    for filename in glob.glob(pattern):
+        if os.path.isfile(filename):
+            sizes[filename] = os.path.getsize(filename)
+    return sizes
+
+def simulate(groups,maxSize,maxFiles,overhead,method):
+
+    numArticles = 0
+    numBytes = 0
+    fill = []
+
+    for dirname,sizes in sorted(groups.items()):
+        filesets = packing.partition(sorted(sizes),sizes,maxSize,maxFiles,method)
+        for fileset in filesets:
+            size = sum([sizes[x] for x in fileset])
+            numArticles += 1
+            numBytes += size+overhead
+            if maxSize:
+                fill.append(min(1.0,float(size)/maxSize))
+
+    if fill:
+        meanFill = sum(fill)/len(fill)
+    else:
+        meanFill = 1.0
+
+    return numArticles,numBytes,meanFill
+
+if __name__ == '__main__':
+
+    usage = 'packsim.py [options] pattern|listing ...'
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-s','--maxsize',dest='maxSize',type='int',
+                      default=10*1024,help='max bytes per article')
+    parser.add_option('-n','--maxfiles',dest='maxFiles',type='int',
+                      default=0,help='max files per article')
+    parser.add_option('-o','--overhead',dest='overhead',type='int',
+                      default=1024,help='bytes of overhead per article')
+    parser.add_option('-l','--listing',action='store_true',dest='listing',
+                      help='arguments are listing files')
+
+    (options,args) = parser.parse_args()
+
+    if not args:
+        parser.error('no files given')
+
+    sizes = {}
+
+    for arg in args:
+        if options.listing:
+            sizes.update(readListing(arg))
+        else:
+            sizes.update(readGlob(arg))
+
+    groups = {}
+
+    for filename,size in sizes.items():
+        groups.setdefault(os.path.dirname(filename),{})[filename] = size
+
+    print '%d files in %d directories, %d bytes' % \
+            (len(sizes),len(groups),sum(sizes.values()))
+    print 'maxsize %d, maxfiles %d, overhead %d bytes/article' % \
+            (options.maxSize,options.maxFiles,options.overhead)
+    print
+
+    baseArticles,baseBytes,baseFill = \
+        simulate(groups,options.maxSize,options.maxFiles,options.overhead,
+                 'sequential')
+
+    print '%-12s %10s %12s %6s %10s %12s' % \
+            ('method','articles','bytes','fill','saved','bytes saved')
+
+    for method in packing.Methods:
+        numArticles,numBytes,meanFill = \
+            simulate(groups,options.maxSize,options.maxFiles,
+                     options.overhead,method)
+        print '%-12s %10d %12d %5.1f%% %10d %12d' % \
+                (method,numArticles,numBytes,meanFill*100,
+                 baseArticles-numArticles,baseBytes-numBytes)
+
+    sys.exit(0)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Rolling hash delta encoding
+#
+#   An rsync style delta between a base file and a new version of
+#   it. The base is split into fixed sized blocks and indexed by a
+#   weak rolling checksum. The new file is scanned a byte at a time
+#   and any window that matches a base block is sent as a copy
+#   instead of literal data.
+#
+#   Unlike rsync, the sender has the base too, so matches are
+#   confirmed by comparing the bytes directly and no strong
+#   checksums are needed in the delta.
+#
+#   Delta format (network byte order):
+#
+#       'SLD1'
+#       blocksize       uint32
+#       target length   uint32
+#       base MD5        16 bytes
+#       target MD5      16 bytes
+#
+#   followed by a sequence of operations:
+#
+#       'C' start count     copy count blocks from base (uint32s)
+#       'L' length data     literal bytes (uint32 length)
+#       'E'                 end
+#
+#   The receiver keeps recent versions of each file and uses the
+#   base MD5 in the header to find the right one.
+#
+#   2026-10-19  Initial implementation
+#
+####################################################################
+
+import md5
+import struct
+
+MAGIC   = 'SLD1'
+HEADER  = '!4sII16s16s'
+
+class DeltaError(Exception):
+    pass
+
+def checksum(block):
+    a = sum(block) & 0xffff
+    b = sum([(len(block)-i)*x for i,x in enumerate(block)]) & 0xffff
+    return a,b
+
+def signature(base,blockSize):
+
+    sigs = {}
+    data = bytearray(base)
+
+    for index in range(len(base)//blockSize):
+        start = index*blockSize
+        a,b = checksum(data[start:start+blockSize])
+        sigs.setdefault((b<<16)|a,[]).append(index)
+
+    return sigs
+
+def baseDigest(delta):
+    header = delta[:struct.calcsize(HEADER)]
+    magic,blockSize,length,baseMD5,targetMD5 = struct.unpack(HEADER,header)
+    if magic!=MAGIC:
+        raise DeltaError('Not a delta file')
+    return baseMD5.encode('hex')
+
+def makeDelta(base,target,blockSize=512):
+
+    sigs    = signature(base,blockSize)
+    data    = bytearray(target)
+    size    = len(target)
+    ops     = []
+
+    def literal(start,stop):
+        if start<stop:
+            ops.append(struct.pack('!cI','L',stop-start)+target[start:stop])
+
+    copyStart = None
+    copyCount = 0
+
+    pos = 0
+    litStart = 0
+
+    if size>=blockSize:
+        a,b = checksum(data[0:blockSize])
+
+    while pos+blockSize<=size:
+
+        match = None
+        key = (b<<16)|a
+
+        if key in sigs:
+            window = target[pos:pos+blockSize]
+            for index in sigs[key]:
+                start = index*blockSize
+                if base[start:start+blockSize]==window:
+                    match = index
+                    break
+
+        if match is not None:
+            if litStart<pos or copyStart is None or \
+               copyStart+copyCount!=match:
+                if copyStart is not None:
+                    ops.append(struct.pack('!cII','C',copyStart,copyCount))
+                literal(litStart,pos)
+                copyStart,copyCount = match,0
+            copyCount += 1
+
+            pos += blockSize
+            litStart = pos
+
+            if pos+blockSize<=size:
+                a,b = checksum(data[pos:pos+blockSize])
+            continue
+
+        if pos+blockSize<size:
+            out,new = data[pos],data[pos+blockSize]
+            a = (a-out+new) & 0xffff
+            b = (b-blockSize*out+a) & 0xffff
+
+        pos += 1
+
+    if copyStart is not None:
+        ops.append(struct.pack('!cII','C',copyStart,copyCount))
+
+    literal(litStart,size)
+    ops.append('E')
+
+    header = struct.pack(HEADER,MAGIC,blockSize,size,
+                         md5.new(base).digest(),
+                         md5.new(target).digest())
+
+    return header+''.join(ops)
+
+def applyDelta(base,delta):
+
+    offset = struct.calcsize(HEADER)
+    magic,blockSize,size,baseMD5,targetMD5 = \
+        struct.unpack(HEADER,delta[:offset])
+
+    if magic!=MAGIC:
+        raise DeltaError('Not a delta file')
+
+    if md5.new(base).digest()!=baseMD5:
+        raise DeltaError('Base does not match delta')
+
+    output = []
+
+    while True:
+        op = delta[offset]
+        offset += 1
+
+        if op=='C':
+            start,count = struct.unpack('!II',delta[offset:offset+8])
+            offset += 8
+            output.append(base[start*blockSize:(start+count)*blockSize])
+        elif op=='L':
+            length = struct.unpack('!I',delta[offset:offset+4])[0]
+            offset += 4
+            output.append(delta[offset:offset+length])
+            offset += length
+        elif op=='E':
+            break
+        else:
+            raise DeltaError('Unknown operation: %s' % repr(op))
+
+    target = ''.join(output)
+
+    if len(target)!=size or md5.new(target).digest()!=targetMD5:
+        raise DeltaError('Reconstructed file does not match')
+
+    return target
@@ -96,6 +96,80 @@
 #               Only allow setSystemTime to make change if we
 #                   are close to the current time (within 30 days).
 #
+#   2026-10-19  Stream files into the spool. Compression, chunking
+#                   and the MD5 checksum are done incrementally
+#                   a block at a time (spool.blocksize).
+#
+#   2026-10-19  Compress with the parallel block compressor
+#                   (compress.workers, compress.blocksize).
+#
+#   2026-10-19  Per group codec (none, zlib, bz2, lzma or auto).
+#                   Auto picks a codec by trial compressing the
+#                   start of each file. The codec is sent in the
+#                   X-Transport-Codec header. X-Transport-Compress
+#                   is only set (to True) when every file is bz2.
+#
+#   2026-10-19  Optional delta transfer per group. Files are sent
+#                   as an rdelta against the last version of the
+#                   same logical file that the ground acknowledged,
+#                   falling back to the full file when there is no
+#                   usable base. The version sent for each file is
+#                   listed in X-Transport-Delta-MD5; the ground acks
+#                   one with X-Transport-Ack-MD5 and no chunk list.
+#                   The bases are kept by deltastore.py.
+#
+#   2026-10-19  Keep posted chunks of split files until the ground
+#                   acknowledges them (X-Transport-Ack-MD5 and
+#                   X-Transport-Ack-Chunks in an inbound message).
+#                   Chunks missing from an ack are reposted on the
+#                   next call. Each chunk carries its own MD5.
+#
+#   2026-10-19  Schedule outbound filesets across all groups by
+#                   deadline, priority and age instead of config
+#                   order. Each call has an optional byte and time
+#                   budget (budget.bytes, budget.time), higher
+#                   priority arrivals are picked up between
+#                   filesets and a report of what was sent and
+#                   deferred is saved (filename.report).
+#
+#   2026-10-19  Keep a history of each call (bytes, time, bps,
+#                   signal, drops) and use it to predict the link
+#                   rate. Filesets that won't fit in the rest of
+#                   the call window are deferred (their spooled
+#                   output is kept and reused on the next call).
+#                   The history is available through the history()
+#                   call.
+#
+#   2026-10-19  Pipeline inbound article retrieval (inbound.window).
+#
+#   2026-10-19  Triage inbound articles from the XOVER data before
+#                   downloading them. Large articles or ones over the
+#                   call budget are deferred, superseded ones skipped.
+#
+#   2026-10-19  Journaled spool. Each fileset is spooled into its own
+#                   directory and an append-only journal records
+#                   when it is spooled, each file posted and when it
+#                   is done. Resume skips anything already posted
+#                   and spooled output is reused across restarts.
+#                   Unstarted spools that no pending fileset matches
+#                   are dropped at the end of sendOutbound.
+#
+#   2026-10-19  Outbound files are listed from a background catalog
+#                   (catalog.py) instead of globbing and sizing every
+#                   file during the call.
+#
+#   2026-10-19  Optional first fit decreasing packing of filesets
+#                   (pack: ffd) to send fewer, fuller articles.
+#
+#   2026-10-19  Per group transfer encoding (encoding: base64 or
+#                   yenc). Inbound yEnc parts are decoded before
+#                   the files are saved.
+#
+#   2026-10-19  Run the inbound poller on a second NNTP session at the
+#                   same time as the outbound transfer (transfer.duplex)
+#                   and log the throughput in each direction. Missing
+#                   chunks are resent after the inbound acks are read.
+#
 ###################################################################
 
 from Transport                  import ProcessClient
@@ -109,18 +183,28 @@ from threading                  import Thread,Lock,Event
 from newskit                    import NewsServer, NewsControl
 from newskit                    import NewsPoller, NewsPoster
 from datetime                   import datetime, timedelta
-from ConfigParser               import ConfigParser
+from ConfigParser               import ConfigParser, RawConfigParser
+from pcompress                  import BlockCompressor
+from catalog                    import FileCatalog
+from deltastore                 import DeltaStore
+
+import pcompress
+import packing
+import rdelta
+import yenc
 
 import os
+import re
 import sys
 import glob
 import email
 import nntplib
 import commands
+import fnmatch
 import socket
 import md5
-import math
-import bz2
+import base64
+import shutil
 
 socket.setdefaulttimeout(10*60)
 
@@ -136,6 +220,18 @@ def synchronized(lock):
         return newFunction
     return wrap
 
+def syncFile(output):
+    output.flush()
+    os.fsync(output.fileno())
+
+def syncDir(path):
+    # Make renames and new files in path durable
+    fd = os.open(path,os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 class StatusData:
 
     lock = Lock()
@@ -163,10 +259,63 @@ class FileGroup(ConfigComponent):
         self.compressFiles  = self.getboolean('compress',False)
         self.removeFiles    = self.getboolean('remove',True)
         self.limit	        = self.getint('limit')
+        self.pack           = self.get('pack','sequential')
+        self.encoding       = self.get('encoding','base64')
+
+        # Lower priority numbers are sent first. Filesets older
+        # than the deadline go ahead of everything else.
+
+        self.priority       = self.getint('priority',10)
+        self.deadline       = self.getDeltaTime('deadline',0)
+
+        # The compress flag is the same as codec=bz2
+
+        defaultCodec = self.compressFiles and 'bz2' or 'none'
+
+        self.codec          = self.get('codec',defaultCodec)
+        self.candidates     = self.getList('codec.candidates','zlib bz2 lzma')
+        self.sampleSize     = self.getBytes('codec.sample',64*1024)
+        self.threshold      = self.getfloat('codec.threshold',0.9)
+
+        # Delta transfers. The logical file name is the basename
+        # with any matches of delta.key replaced (timestamps).
+
+        self.delta          = self.getboolean('delta',False)
+        self.deltaKey       = re.compile(self.get('delta.key','[0-9]+'))
+        self.deltaBlockSize = self.getBytes('delta.blocksize',512)
+        self.deltaMaxSize   = self.getBytes('delta.maxsize',1024*1024)
+        self.deltaThreshold = self.getfloat('delta.threshold',0.5)
+        self.deltaMaxChain  = self.getint('delta.maxchain',20)
+
+        if self.encoding not in ['base64','yenc']:
+            raise ValueError('Unknown encoding for %s: %s' % \
+                                (name,self.encoding))
+
+        if self.pack not in packing.Methods:
+            raise ValueError('Unknown packing for %s: %s' % (name,self.pack))
+
+        # Deltas chain from one version to the next, so they have
+        # to go out in time order.
+
+        if self.delta and self.pack!='sequential':
+            self.log.error('Delta group %s must be packed sequentially' % name)
+            self.pack = 'sequential'
+
+        if self.codec not in ['none','auto']+pcompress.Codecs.keys():
+            raise ValueError('Unknown codec for %s: %s' % (name,self.codec))
+
+        if self.codec not in ['none','auto']:
+            if not pcompress.available(self.codec):
+                self.log.error('Codec %s not available, using bz2' % self.codec)
+                self.codec = 'bz2'
 
         self.log.info('%s:' % name)
         self.log.info('  files: %s' % self.filespecs)
         self.log.info('  group: %s' % self.newsgroup)
+        self.log.info('  codec: %s' % self.codec)
+
+    def logicalName(self,basename):
+        return '%s/%s' % (self.name,self.deltaKey.sub('#',basename))
 
     def limitFiles(self,files):
 
@@ -185,36 +334,551 @@ class FileGroup(ConfigComponent):
 
         return files
 
-    def partitionFiles(self,files):
+    def partitionFiles(self,files,stats={}):
 
-        result   = []
-        curSize  = 0
-        curFiles = []
+        # stats: path -> (size,mtime) if already known
 
         if self.limit is not None:
             files = self.limitFiles(files)
 
+        sizes = {}
+
         for filename in files:
-            filesize = os.path.getsize(filename)
+            if filename in stats:
+                sizes[filename] = stats[filename][0]
+            else:
+                sizes[filename] = os.path.getsize(filename)
+
+        return packing.partition(files,sizes,self.maxSize,self.maxFiles,
+                                 self.pack)
+
+class LinkHistory:
+
+    # One line per call, most recent last:
+    #
+    #   start-time bytes secs bps signal drops predicted-bps
+    #
+    # A signal of -1 means it is unknown (no modem query).
+
+    fields = ['time','bytes','secs','bps','signal','drops','predicted']
+
+    def __init__(self,filename,maxEntries,defaultRate,numRecent):
+        self.filename       = filename
+        self.maxEntries     = maxEntries
+        self.defaultRate    = defaultRate
+        self.numRecent      = numRecent
+
+    def load(self):
+
+        entries = []
+
+        if not os.path.exists(self.filename):
+            return entries
+
+        for line in open(self.filename):
+            values = line.split()
+            if len(values)!=len(self.fields):
+                continue
+            entry = dict(zip(self.fields,values))
+            for key in self.fields[1:]:
+                entry[key] = float(entry[key])
+            entries.append(entry)
+
+        return entries
+
+    def add(self,entry):
+
+        entries = self.load()+[entry]
+        entries = entries[-self.maxEntries:]
+
+        output = open(self.filename+'.new','w')
+        for entry in entries:
+            values = [entry[key] for key in self.fields]
+            print >> output,'%s %d %.1f %d %d %d %d' % tuple(values)
+        output.close()
+
+        os.rename(self.filename+'.new',self.filename)
+
+    def predict(self,signal=-1):
+
+        # Median rate of recent calls, using only calls with the
+        # same signal strength if there are enough of them.
+
+        entries = [x for x in self.load() if x['secs']>0]
+
+        sameSignal = [x for x in entries if x['signal']==signal]
+
+        if signal>=0 and len(sameSignal)>=3:
+            entries = sameSignal
+
+        rates = sorted([x['bps'] for x in entries[-self.numRecent:]])
+
+        if not rates:
+            return self.defaultRate
+
+        return rates[len(rates)//2]
+
+class FileSet:
+
+    def __init__(self,group,filenames,stats={}):
+
+        # stats: path -> (size,mtime) if already known
+
+        entries = []
+
+        for filename in filenames:
+            if filename in stats:
+                entries.append(stats[filename])
+            else:
+                entries.append((os.path.getsize(filename),
+                                os.path.getmtime(filename)))
+
+        self.group      = group
+        self.filenames  = filenames
+        self.size       = sum([size for size,mtime in entries])
+        self.mtime      = min([mtime for size,mtime in entries])
+        self.reason     = None
+
+    def age(self,now):
+        return now-datetime.fromtimestamp(self.mtime)
+
+    def overdue(self,now):
+        return bool(self.group.deadline) and self.age(now)>self.group.deadline
+
+    def sortKey(self,now):
+        return (not self.overdue(now),self.group.priority,self.mtime)
+
+class SpoolWriter:
+
+    def __init__(self,filename):
+        self.filenames  = [filename]
+        self.checksum   = md5.new()
+        self.numBytes   = 0
+        self.output     = open(filename,'wb')
+
+    def write(self,data):
+        self.checksum.update(data)
+        self.numBytes += len(data)
+        self.output.write(data)
+
+    def close(self):
+        syncFile(self.output)
+        self.output.close()
+
+    def remove(self):
+        self.close()
+        for filename in self.filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+class ChunkWriter(SpoolWriter):
+
+    # Split the output stream into chunk.NNNN files of maxSize bytes
+
+    def __init__(self,path,maxSize):
+        self.path       = path
+        self.maxSize    = maxSize
+        self.filenames  = []
+        self.checksum   = md5.new()
+        self.checksums  = []
+        self.numBytes   = 0
+        self.output     = None
+
+    def nextChunk(self):
+        chunkname = os.path.join(self.path,'chunk.%04d' % len(self.filenames))
+        self.filenames.append(chunkname)
+        self.checksums.append(md5.new())
+        self.output = open(chunkname,'wb')
+        self.curSize = 0
+
+    def write(self,data):
+
+        self.checksum.update(data)
+        self.numBytes += len(data)
+
+        while data:
+            if self.output is None:
+                self.nextChunk()
+
+            bytes = data[:self.maxSize-self.curSize]
+            self.output.write(bytes)
+            self.checksums[-1].update(bytes)
+            self.curSize += len(bytes)
+            data = data[len(bytes):]
+
+            if self.curSize==self.maxSize:
+                self.close()
+
+    def close(self):
+        if self.output:
+            syncFile(self.output)
+            self.output.close()
+        self.output = None
+
+class ChunkStore:
+
+    # Chunks of split files are kept after posting until the ground
+    # acknowledges them. Each split file has a directory named by
+    # its MD5 with the chunks and a manifest of their headers:
+    #
+    #   [manifest]
+    #   created:    <timestamp>
+    #   numchunks:  <N>
+    #   resend:     <chunk numbers to repost>
+    #
+    #   [chunk.NNNN]
+    #   <article headers>
+    #
+    # Files are dropped once they are older than maxAge, oldest
+    # first if the store grows past maxSize. Chunks an ack says are
+    # missing but that we no longer have are dropped from the
+    # resend list (and logged) once.
+
+    def __init__(self,path,maxAge,maxSize,log):
+        self.path   = path
+        self.maxAge = maxAge
+        self.maxSize= maxSize
+        self.log    = log
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def dirname(self,checksum):
+        return os.path.join(self.path,checksum)
+
+    def loadManifest(self,checksum):
+        manifest = RawConfigParser()
+        manifest.read(os.path.join(self.dirname(checksum),'manifest.conf'))
+        return manifest
+
+    def saveManifest(self,checksum,manifest):
+        filename = os.path.join(self.dirname(checksum),'manifest.conf')
+        output = open(filename+'.new','w')
+        manifest.write(output)
+        output.close()
+        os.rename(filename+'.new',filename)
+
+    def getResend(self,manifest):
+        return set([int(x) for x in manifest.get('manifest','resend').split()])
+
+    def setResend(self,manifest,chunks):
+        manifest.set('manifest','resend',' '.join([str(x) for x in sorted(chunks)]))
+
+    def retain(self,filename,headers):
+
+        checksum = headers['x-transport-md5']
+        chunk,numChunks = [int(x) for x in headers['x-transport-part'].split('/')]
+        dirname = self.dirname(checksum)
+
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        manifest = self.loadManifest(checksum)
+
+        if not manifest.has_section('manifest'):
+            manifest.add_section('manifest')
+            manifest.set('manifest','created',str(datetime.now()))
+            manifest.set('manifest','numchunks',str(numChunks))
+            manifest.set('manifest','resend','')
+
+        section = 'chunk.%04d' % chunk
+
+        if not manifest.has_section(section):
+            manifest.add_section(section)
+
+        for key,value in headers.items():
+            manifest.set(section,key,value)
+
+        os.rename(filename,os.path.join(dirname,section))
+
+        self.saveManifest(checksum,manifest)
+
+    def acknowledge(self,checksum,received):
+
+        # Returns the set of chunks that need to be reposted
+
+        dirname = self.dirname(checksum)
+
+        if not os.path.exists(dirname):
+            self.log.info('    - no retained chunks for %s' % checksum)
+            return set()
+
+        manifest = self.loadManifest(checksum)
+        numChunks = manifest.getint('manifest','numchunks')
+
+        for chunk in received:
+            chunkname = os.path.join(dirname,'chunk.%04d' % chunk)
+            if os.path.exists(chunkname):
+                os.remove(chunkname)
+
+        missing = set(range(numChunks)).difference(received)
+
+        if not missing:
+            self.log.info('    - all %d chunks received' % numChunks)
+            self.remove(checksum)
+            return missing
+
+        self.log.info('    - %d of %d chunks missing' % (len(missing),numChunks))
+
+        lost = set([chunk for chunk in missing if not
+                    os.path.exists(os.path.join(dirname,'chunk.%04d' % chunk))])
+
+        if lost:
+            self.log.error('    - %d missing chunks are not retained' % len(lost))
+            missing = missing.difference(lost)
+
+        if not missing:
+            self.remove(checksum)
+            return missing
+
+        self.setResend(manifest,missing)
+        self.saveManifest(checksum,manifest)
+
+        return missing
+
+    def pending(self):
+
+        # List of (checksum,chunk filename,headers) to repost
+
+        results = []
+
+        for dirname in sorted(glob.glob(os.path.join(self.path,'*'))):
+            checksum = os.path.basename(dirname)
+            manifest = self.loadManifest(checksum)
+
+            if not manifest.has_section('manifest'):
+                continue
+
+            resend = self.getResend(manifest)
+
+            for chunk in sorted(resend):
+                section = 'chunk.%04d' % chunk
+                chunkname = os.path.join(dirname,section)
+                if not os.path.exists(chunkname):
+                    self.log.error('Missing retained chunk: %s' % chunkname)
+                    resend.discard(chunk)
+                    continue
+                headers = dict(manifest.items(section))
+                results.append((checksum,chunkname,headers))
+
+            if resend!=self.getResend(manifest):
+                self.setResend(manifest,resend)
+                self.saveManifest(checksum,manifest)
+
+        return results
+
+    def isPending(self,checksum,chunkname):
+
+        # Still waiting to be reposted? An ack may have arrived since
+        # pending() was called.
+
+        if not os.path.exists(chunkname):
+            return False
+
+        manifest = self.loadManifest(checksum)
+        chunk = int(chunkname.split('.')[-1])
+
+        return chunk in self.getResend(manifest)
+
+    def resent(self,checksum,chunkname):
+        if not os.path.exists(self.dirname(checksum)):
+            return          # fully acknowledged meanwhile
+        manifest = self.loadManifest(checksum)
+        chunk = int(chunkname.split('.')[-1])
+        self.setResend(manifest,self.getResend(manifest).difference([chunk]))
+        self.saveManifest(checksum,manifest)
+
+    def remove(self,checksum):
+        dirname = self.dirname(checksum)
+        for filename in glob.glob(os.path.join(dirname,'*')):
+            os.remove(filename)
+        os.rmdir(dirname)
+
+    def expire(self):
 
-            if self.maxSize and curSize+filesize>self.maxSize:
-                if curFiles:
-                    result.append(curFiles)
-                curSize  = 0
-                curFiles = []
+        entries = []
+        total = 0
 
-            curSize+=filesize
-            curFiles.append(filename)
+        for dirname in glob.glob(os.path.join(self.path,'*')):
+            mtime = os.path.getmtime(dirname)
+            age = datetime.now()-datetime.fromtimestamp(mtime)
+            if age>self.maxAge:
+                self.log.info('    - expiring retained chunks %s' % dirname)
+                self.remove(os.path.basename(dirname))
+                continue
+            size = sum([os.path.getsize(x)
+                        for x in glob.glob(os.path.join(dirname,'*'))])
+            entries.append((mtime,size,dirname))
+            total += size
+
+        entries.sort()
+
+        while self.maxSize and total>self.maxSize and entries:
+            mtime,size,dirname = entries.pop(0)
+            self.log.info('    - removing retained chunks %s (size)' % dirname)
+            self.remove(os.path.basename(dirname))
+            total -= size
+
+class SpoolJournal:
+
+    # Each fileset is spooled into its own directory, <path>/<id>,
+    # with a spool.conf of the article headers. The journal is an
+    # append only log of what has happened to them:
+    #
+    #   spooled <id> <source>...    path:size:mtime of each source
+    #   posted  <id> <file>...      spool files posted
+    #   done    <id>                fileset finished or dropped
+    #
+    # Each line is fsync'd before we act on it, so after a crash the
+    # journal tells us what was spooled and what was already posted
+    # without rescanning the spool. Spool directories that never made
+    # it into the journal were only partly written and are removed.
+
+    def __init__(self,path,log):
+        self.path       = path
+        self.log        = log
+        self.filename   = os.path.join(path,'journal')
+        self.filesets   = {}
+        self.nextId     = 1
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        self.load()
+        self.cleanup()
+
+    def load(self):
+
+        if not os.path.exists(self.filename):
+            return
+
+        for line in open(self.filename):
+
+            # Partial last line from a crash in mid write
+            if not line.endswith('\n'):
+                break
+
+            fields = line.rstrip('\n').split('\t')
+            op,id = fields[0],int(fields[1])
+
+            if op=='spooled':
+                self.filesets[id] = dict(sources=fields[2:],posted=set())
+                self.nextId = max(self.nextId,id+1)
+            elif op=='posted' and id in self.filesets:
+                self.filesets[id]['posted'].update(fields[2:])
+            elif op=='done':
+                self.filesets.pop(id,None)
+
+    def append(self,*fields):
+        output = open(self.filename,'a')
+        output.write('\t'.join([str(x) for x in fields])+'\n')
+        syncFile(output)
+        output.close()
+
+    def compact(self):
+
+        # Rewrite the journal with only the live filesets
+
+        output = open(self.filename+'.new','w')
+
+        for id in self.live():
+            fileset = self.filesets[id]
+            fields = ['spooled',id]+fileset['sources']
+            output.write('\t'.join([str(x) for x in fields])+'\n')
+            if fileset['posted']:
+                fields = ['posted',id]+sorted(fileset['posted'])
+                output.write('\t'.join([str(x) for x in fields])+'\n')
+
+        syncFile(output)
+        output.close()
+
+        os.rename(self.filename+'.new',self.filename)
+        syncDir(self.path)
+
+    def cleanup(self):
+
+        for dirname in glob.glob(os.path.join(self.path,'*')):
+            basename = os.path.basename(dirname)
+            if not os.path.isdir(dirname) or not basename.isdigit():
+                continue
+            if int(basename) not in self.filesets:
+                self.log.info('    - removing partial spool %s' % dirname)
+                self.removeDir(dirname)
+
+        self.compact()
+
+    def removeDir(self,dirname):
+        for filename in glob.glob(os.path.join(dirname,'*')):
+            os.remove(filename)
+        os.rmdir(dirname)
+
+    def signature(self,filename):
+        return '%s:%d:%d' % (filename,os.path.getsize(filename),
+                             os.path.getmtime(filename))
+
+    def dirname(self,id):
+        return os.path.join(self.path,str(id))
+
+    def create(self):
+        id = self.nextId
+        self.nextId += 1
+        os.makedirs(self.dirname(id))
+        return id
+
+    def discard(self,id):
+        # Fileset that was never journaled
+        self.removeDir(self.dirname(id))
+
+    def spooled(self,id,filenames):
+        syncDir(self.dirname(id))
+        sources = [self.signature(x) for x in filenames]
+        self.append('spooled',id,*sources)
+        self.filesets[id] = dict(sources=sources,posted=set())
+
+    def posted(self,id,names):
+        self.append('posted',id,*names)
+        self.filesets[id]['posted'].update(names)
+
+    def isPosted(self,id,name):
+        return name in self.filesets[id]['posted']
+
+    def started(self,id):
+        return len(self.filesets[id]['posted'])>0
+
+    def done(self,id):
+        self.append('done',id)
+        del self.filesets[id]
+        self.removeDir(self.dirname(id))
+
+        if not self.filesets:
+            self.compact()
+
+    def live(self):
+        return sorted(self.filesets.keys())
+
+    def find(self,filenames):
 
-            if self.maxFiles and len(curFiles)==self.maxFiles:
-                result.append(curFiles)
-                curSize  = 0
-                curFiles = []
+        # Unstarted fileset already spooled from these files
 
-        if curFiles:
-            result.append(curFiles)
+        sources = [self.signature(x) for x in filenames]
 
-        return result
+        for id in self.live():
+            if self.filesets[id]['sources']==sources and not self.started(id):
+                return id
+
+        return None
+
+    def isCurrent(self,id):
+
+        # Are the source files unchanged since they were spooled?
+
+        for source in self.filesets[id]['sources']:
+            filename = source.rsplit(':',2)[0]
+            if not os.path.exists(filename) or \
+               self.signature(filename)!=source:
+                return False
+
+        return True
 
 class WorkerThread(Thread, AccessMixin):
 
@@ -234,15 +898,65 @@ class WorkerThread(Thread, AccessMixin):
         for map in self.groups:
             self.log.info('  - %s' % map.name)
 
+        self.callWindow     = self.getDeltaTime('call.window',0)
+        self.planMargin     = self.getfloat('planner.margin',0.8)
+        self.budgetBytes    = self.getBytes('budget.bytes',0)
+        self.budgetTime     = self.getDeltaTime('budget.time',0)
         self.retryWait      = self.getDeltaTime('retry.wait',60)
         self.maxRetries     = self.getint('retry.max',10)
         self.flagFile       = self.get('filename.flag')
         self.queryModem     = self.getboolean('querymodem',True)
         self.spoolRoot      = self.get('spool','.')
         self.spoolDir       = os.path.join(self.spoolRoot,'spool')
-        self.spoolConf      = os.path.join(self.spoolRoot,'spool.conf')
+        self.blockSize      = self.getBytes('spool.blocksize',256*1024)
+
+        self.compressBlockSize  = self.getBytes('compress.blocksize')
+        self.compressWorkers    = self.getint('compress.workers')
+        self.compressors        = {}
+
+        self.history = LinkHistory(os.path.join(self.spoolRoot,'history'),
+                                self.getint('history.size',100),
+                                self.getint('planner.bps',1200),
+                                self.getint('planner.calls',10))
+
+        self.chunkStore = ChunkStore(os.path.join(self.spoolRoot,'retain'),
+                                self.getDeltaTime('retain.maxage',7*24*60*60),
+                                self.getBytes('retain.maxsize',16*1024*1024),
+                                self.log)
+
+        self.deltaStore = DeltaStore(os.path.join(self.spoolRoot,'delta'),
+                                self.getBytes('delta.store.maxsize',4*1024*1024),
+                                self.log)
+
+        self.journal = SpoolJournal(self.spoolDir,self.log)
+
+        if self.getboolean('catalog.enable',True):
+            interval = self.getDeltaTime('catalog.interval',30)
+            settle = self.getDeltaTime('catalog.settle',60)
+            self.catalog = FileCatalog(self.groups,
+                                datefunc.timedelta_as_seconds(interval),
+                                datefunc.timedelta_as_seconds(settle),
+                                self.get('catalog.backend','auto'),
+                                self.log)
+            self.catalog.start()
+        else:
+            self.catalog = None
+
+        self.adoptLegacySpool()
+        self.deltaStore.discardStaged(
+            [name for mode,name,checksum,key in self.stagedDeltas()])
+
+        # With duplex, inbound articles are read on a second session
+        # while the outbound transfer runs on the first.
+
+        self.duplex     = self.getboolean('transfer.duplex',False)
+        self.duplexWait = self.getDeltaTime('transfer.duplex.wait',300)
+        self.sessionStop = Event()
+        self.outboundDone = Event()
+        self.chunkLock  = Lock()
 
         self.server     = NewsServer(parent.rudicsHost, parent.rudicsPort)
+        self.inboundServer = NewsServer(parent.rudicsHost, parent.rudicsPort)
         self.poller     = NewsPoller(self.server, log=self.log)
         self.poster     = NewsPoster(self.server, log=self.log)
         self.control    = NewsControl(self.server, log=self.log)
@@ -251,9 +965,14 @@ class WorkerThread(Thread, AccessMixin):
         self.poller.setStopFunc(self.isStopped)
         self.poller.setCallback(self.processInbound)
         self.poller.setDebug(True)
+        self.poller.setWindow(self.getint('inbound.window',4))
+
+        self.inboundMaxSize     = self.getBytes('inbound.maxsize',0)
+        self.inboundBudget      = self.getBytes('inbound.budget',0)
+        self.inboundSupersede   = self.getList('inbound.supersede','')
 
-        if not os.path.exists(self.spoolDir):
-            os.makedirs(self.spoolDir)
+        if self.getboolean('inbound.triage',False):
+            self.poller.setTriage(self.triageInbound)
 
         self.cache = self.connect('cache')
 
@@ -261,7 +980,7 @@ class WorkerThread(Thread, AccessMixin):
         return self.running and self.parent.runRequest.isSet()
 
     def isStopped(self):
-        return not self.isRunning()
+        return not self.isRunning() or self.sessionStop.isSet()
 
     def run(self):
 
@@ -299,6 +1018,7 @@ class WorkerThread(Thread, AccessMixin):
                 return True
             except:
                 self.log.exception('Problem')
+                self.drops+=1
                 numRetries+=1
                 self.log.info('Waiting %s' % self.retryWait)
                 self.wait(self.retryWait)
@@ -312,9 +1032,94 @@ class WorkerThread(Thread, AccessMixin):
 
         open(self.flagFile,'w').write(str(datetime.now()))
 
-        if self.isRunning():    self.getInbound()
-        if self.isRunning():    self.resumeTransfer()
-        if self.isRunning():    self.sendOutbound()
+        self.sessionStop.clear()
+        self.outboundDone.clear()
+        self.inboundDone = False
+
+        inbound = None
+
+        if self.duplex and self.isRunning():
+            inbound = Thread(target=self.inboundSession)
+            inbound.setDaemon(True)
+            inbound.start()
+        elif self.isRunning():
+            self.poller.server = self.server
+            self.getInbound()
+
+        try:
+            if self.isRunning():    self.resumeTransfer()
+            if self.isRunning():    self.sendOutbound()
+        except:
+            # Stop the inbound side too, closing the connection
+            # wakes it up if it is blocked on a read.
+            self.stopInbound()
+            raise
+        finally:
+            self.outboundDone.set()
+            if inbound:
+                self.joinInbound(inbound)
+
+        # Second session couldn't be used, read inbound here
+
+        if inbound and not inbound.isAlive() and not self.inboundDone \
+           and self.isRunning():
+            self.log.info('  * Inbound session failed, using main session')
+            self.poller.server = self.server
+            self.getInbound()
+
+        # Only resend once this session's acks have been read, so
+        # chunks the ground already has aren't posted again.
+
+        if inbound and inbound.isAlive():
+            self.log.info('  * Inbound session still running, no resend')
+        elif self.isRunning():
+            self.resendChunks()
+
+    def stopInbound(self):
+        self.sessionStop.set()
+        self.inboundServer.close()
+
+    def joinInbound(self,inbound):
+
+        # Give the inbound session transfer.duplex.wait to finish
+        # once the outbound side is done, then stop it.
+
+        inbound.join(datefunc.timedelta_as_seconds(self.duplexWait))
+
+        if inbound.isAlive():
+            self.log.info('  * Inbound session taking too long, stopping')
+            self.stopInbound()
+            inbound.join(datefunc.timedelta_as_seconds(self.retryWait))
+
+    def inboundSession(self):
+
+        # Runs in its own thread alongside the outbound transfer.
+        # Failures are retried until the outbound side is finished,
+        # after which transfer() falls back to the main session.
+
+        retryWait = datefunc.timedelta_as_seconds(self.retryWait)
+        numRetries = 0
+
+        while not self.isStopped() and numRetries<self.maxRetries:
+
+            try:
+                self.log.info('  * Opening inbound session')
+                self.inboundServer.open()
+                self.poller.server = self.inboundServer
+                self.getInbound()
+                self.inboundDone = True
+                break
+            except:
+                self.log.exception('Problem in inbound session')
+                self.inboundDrops+=1
+                numRetries+=1
+
+            self.outboundDone.wait(retryWait)
+
+            if self.outboundDone.isSet():
+                break
+
+        self.inboundServer.close()
 
     def process(self):
 
@@ -324,6 +1129,12 @@ class WorkerThread(Thread, AccessMixin):
         self.totalBytesOut = 0
         self.totalDataBytesOut = 0
         self.totalDataBytesIn = 0
+        self.postBytes = 0
+        self.postSecs = 0
+        self.inboundSecs = 0
+        self.drops = 0
+        self.inboundDrops = 0
+        self.signal = -1
         starttime = datetime.now()
 
         if self.retry(self.getStats):
@@ -331,11 +1142,25 @@ class WorkerThread(Thread, AccessMixin):
             # getStats resets the clock...
             starttime = datetime.now()
 
-            self.retry(self.transfer)
+            self.callStart = starttime
+            self.predictedRate = self.history.predict(self.signal)
+
+            # Each thread counts its own drops
+            self.drops = 0
+            self.inboundDrops = 0
+
+            self.log.info('  * Predicted rate: %d bps' % self.predictedRate)
+
+            try:
+                self.retry(self.transfer)
+            finally:
+                self.closeCompressors()
 
             self.log.info('  * Closing news server')
             self.server.close()
 
+            self.saveHistory(starttime)
+
         elapsed = datetime.now()-starttime
 
         self.log.info('Processing finished:')
@@ -344,6 +1169,74 @@ class WorkerThread(Thread, AccessMixin):
         self.log.info('  bytes out : %s' % sizeDesc(self.totalBytesOut))
         self.log.info('  data  in  : %s' % sizeDesc(self.totalDataBytesIn))
         self.log.info('  data  out : %s' % sizeDesc(self.totalDataBytesOut))
+        self.log.info('  inbound   : %d bps (%.1f secs)' % \
+                        (self.inboundRate(),self.inboundSecs))
+        self.log.info('  outbound  : %d bps (%.1f secs)' % \
+                        (self.actualRate(),self.postSecs))
+
+    def actualRate(self):
+        if not self.postSecs:
+            return 0
+        return int(self.postBytes*8/self.postSecs)
+
+    def inboundRate(self):
+        if not self.inboundSecs:
+            return 0
+        return int(self.totalBytesIn*8/self.inboundSecs)
+
+    def saveHistory(self,starttime):
+
+        entry = dict(time        = starttime.strftime('%Y%m%d-%H%M%S'),
+                     bytes       = self.postBytes,
+                     secs        = self.postSecs,
+                     bps         = self.actualRate(),
+                     signal      = self.signal,
+                     drops       = self.drops+self.inboundDrops,
+                     predicted   = self.predictedRate)
+
+        self.log.info('  predicted: %d bps, actual: %d bps' % \
+                        (self.predictedRate,entry['bps']))
+
+        try:
+            self.history.add(entry)
+        except:
+            self.log.exception('Problem saving history')
+
+    def fitsWindow(self,numBytes):
+
+        # Can numBytes be sent in what is left of the call window?
+
+        if not self.callWindow:
+            return True
+
+        if self.predictedRate<=0:
+            return False
+
+        window = datefunc.timedelta_as_seconds(self.callWindow)
+        elapsed = datefunc.timedelta_as_seconds(datetime.now()-self.callStart)
+        needed = numBytes*8.0/self.predictedRate
+
+        return needed<=(window-elapsed)*self.planMargin
+
+    def spoolBytes(self,id):
+
+        # Estimated bytes on the wire for a spooled fileset: the
+        # transfer encoding plus article headers.
+
+        config = self.spoolConfig(id)
+
+        if config.has_option('DEFAULT','spool.encoding') and \
+           config.get('DEFAULT','spool.encoding')=='yenc':
+            factor = 1.02
+        else:
+            factor = 4/3.0
+
+        numBytes = 0
+
+        for filename in self.spoolFiles(id):
+            numBytes += int(os.path.getsize(filename)*factor) + 1024
+
+        return numBytes
 
     def getStats(self):
 
@@ -359,6 +1252,8 @@ class WorkerThread(Thread, AccessMixin):
             self.saveStats(stats, curtime)
             self.cache.put('iridium',stats)
 
+            self.signal = int(stats.get('signal',-1))
+
         else:
             self.log.info('  * syncing time to news server')
             try:
@@ -417,7 +1312,58 @@ class WorkerThread(Thread, AccessMixin):
 
     def getInbound(self):
         self.log.info('  * Processing inbound messages')
-        self.poller.processUnreadMessages()
+
+        startBytes = self.poller.bytesRead
+        starttime = datetime.now()
+
+        try:
+            self.poller.processUnreadMessages()
+        finally:
+            elapsed = datetime.now()-starttime
+            self.inboundSecs += datefunc.timedelta_as_seconds(elapsed)
+            self.totalBytesIn += self.poller.bytesRead-startBytes
+
+    def superseded(self,overviews):
+
+        # Articles matching inbound.supersede are replaced by a later
+        # article with the same subject.
+
+        latest = {}
+
+        for entry in overviews:
+            for pattern in self.inboundSupersede:
+                if fnmatch.fnmatch(entry['subject'],pattern):
+                    latest[entry['subject']] = entry['num']
+
+        return set([x['num'] for x in overviews
+                    if latest.get(x['subject'],x['num'])!=x['num']])
+
+    def triageInbound(self,overviews):
+
+        fetch = []
+        defer = []
+        numBytes = 0
+
+        skip = self.superseded(overviews)
+
+        for entry in overviews:
+
+            num,size = entry['num'],entry['size']
+
+            if num in skip:
+                self.log.info('    skip %d (superseded): %s' % \
+                                (num,entry['subject']))
+            elif self.inboundMaxSize and size>self.inboundMaxSize:
+                self.log.info('    defer %d (%d bytes)' % (num,size))
+                defer.append(num)
+            elif self.inboundBudget and numBytes+size>self.inboundBudget:
+                self.log.info('    defer %d (budget)' % num)
+                defer.append(num)
+            else:
+                fetch.append(num)
+                numBytes += size
+
+        return fetch,defer
 
     def ackInbound(self, message):
         filename = self.currentTime().strftime(self.get('filename.ack'))
@@ -431,14 +1377,129 @@ class WorkerThread(Thread, AccessMixin):
         print >> out,message['XRef']
         out.close()
 
+    def parseChunkList(self,text):
+
+        # 0-4,7,9-10 -> set([0,1,2,3,4,7,9,10])
+
+        chunks = set()
+
+        for entry in text.replace(' ','').split(','):
+            if not entry:
+                continue
+            if '-' in entry:
+                first,last = entry.split('-')
+                chunks.update(range(int(first),int(last)+1))
+            else:
+                chunks.add(int(entry))
+
+        return chunks
+
+    def processChunkAck(self, message):
+
+        checksum = message['X-Transport-Ack-MD5'].strip()
+
+        # Without a chunk list this acknowledges a delta group file,
+        # by the MD5 given for it in X-Transport-Delta-MD5
+
+        if message['X-Transport-Ack-Chunks'] is None:
+            if not self.deltaStore.acknowledge(checksum):
+                self.log.info('  no pending delta version %s' % checksum)
+            return
+
+        received = self.parseChunkList(message['X-Transport-Ack-Chunks'])
+
+        self.log.info('  chunk ack for %s: %d received' % (checksum,len(received)))
+
+        self.chunkLock.acquire()
+        try:
+            self.chunkStore.acknowledge(checksum,received)
+        finally:
+            self.chunkLock.release()
+
+    def resendChunks(self):
+
+        # Acks can be processed by the inbound session while we are
+        # in here, so the chunk store is locked and each chunk is
+        # checked again before it is reposted.
+
+        self.chunkLock.acquire()
+        try:
+            self.chunkStore.expire()
+            pending = self.chunkStore.pending()
+        finally:
+            self.chunkLock.release()
+
+        if not pending:
+            return
+
+        self.log.info('  * Reposting %d missing chunks' % len(pending))
+
+        resendDir = os.path.join(self.spoolRoot,'resend')
+
+        if not os.path.exists(resendDir):
+            os.makedirs(resendDir)
+
+        for checksum,chunkname,headers in pending:
+            if not self.isRunning():
+                break
+
+            # Post a copy so that an ack arriving meanwhile can
+            # remove the retained chunk.
+
+            copyname = os.path.join(resendDir,os.path.basename(chunkname))
+
+            self.chunkLock.acquire()
+            try:
+                if self.chunkStore.isPending(checksum,chunkname):
+                    shutil.copyfile(chunkname,copyname)
+                else:
+                    copyname = None
+            finally:
+                self.chunkLock.release()
+
+            if not copyname:
+                continue
+
+            try:
+                self.postArticle([copyname],headers)
+            finally:
+                os.remove(copyname)
+
+            self.chunkLock.acquire()
+            try:
+                self.chunkStore.resent(checksum,chunkname)
+            finally:
+                self.chunkLock.release()
+
+    def decodeYenc(self, message):
+
+        # Turn x-yenc parts into base64 for NewsTool.saveFiles
+
+        for part in message.walk():
+            if part.get('Content-Transfer-Encoding','').lower()!='x-yenc':
+                continue
+            name,data = yenc.decode(part.get_payload())
+            self.log.info('  - decoded yEnc part %s (%d bytes)' % (name,len(data)))
+            part.set_payload(base64.encodestring(data))
+            part.replace_header('Content-Transfer-Encoding','base64')
+
     def processInbound(self, message):
         self.log.info('Inbound: %s' % message['XRef'])
 
+        if message['X-Transport-Ack-MD5']:
+            try:
+                self.processChunkAck(message)
+            except:
+                self.log.exception('Problem processing chunk ack')
+            self.ackInbound(message)
+            return
+
         dest = message['X-Transport-DestPath'] or '/home/ftp/inbound'
 
         self.log.info('Saving to path %s' % dest)
 
         try:
+            self.decodeYenc(message)
             filenames = NewsTool.saveFiles(message, path=dest)
         except:
             # should make a note in an outbound trouble group...
@@ -455,9 +1516,19 @@ class WorkerThread(Thread, AccessMixin):
 
     def resumeTransfer(self):
 
-        if os.path.exists(self.spoolConf):
-            self.log.info('  * Resuming outbound transfer')
-            self.sendSpool()
+        # Finish filesets that were partly posted. Ones that haven't
+        # been started are left for sendOutbound to pick up again,
+        # unless their source files have changed.
+
+        for id in self.journal.live():
+            if not self.isRunning():
+                break
+            if self.journal.started(id):
+                self.log.info('  * Resuming outbound transfer %d' % id)
+                self.sendSpool(id)
+            elif not self.journal.isCurrent(id):
+                self.log.info('  * Dropping stale spool %d' % id)
+                self.dropSpool(id)
 
     def createGroup(self,group):
         self.log.info('    Group "%s" does not exist, creating it' % group)
@@ -476,36 +1547,167 @@ class WorkerThread(Thread, AccessMixin):
 
         raise IOError('Timeout waiting for group creation')
 
-    def sendSpool(self):
+    def spoolConfig(self,id):
+        config = ConfigParser()
+        config.read(os.path.join(self.journal.dirname(id),'spool.conf'))
+        return config
 
-        files = glob.glob(os.path.join(self.spoolDir, '*'))
-        files.sort()
+    def spoolFiles(self,id):
+        config = self.spoolConfig(id)
+        dirname = self.journal.dirname(id)
+        names = config.get('DEFAULT','spool.files').split('\n')
+        return [os.path.join(dirname,x) for x in names if x]
 
-        if not files:
+    def stagedEntries(self,config):
+
+        # [(mode,name,md5,key),...] staged by a spooled fileset
+
+        if not config.has_option('DEFAULT','delta.staged'):
+            return []
+
+        return [tuple(entry.split(' ',3))
+                for entry in config.get('DEFAULT','delta.staged').split('\n')]
+
+    def stagedDeltas(self):
+
+        # Delta versions staged by filesets still in the spool
+
+        entries = []
+
+        for id in self.journal.live():
+            entries.extend(self.stagedEntries(self.spoolConfig(id)))
+
+        return entries
+
+    def adoptLegacySpool(self):
+
+        # Move a spool left by an earlier version (spool/* files and
+        # spool.conf) into the journal so that it is resumed.
+
+        legacyConf = os.path.join(self.spoolRoot,'spool.conf')
+
+        if not os.path.exists(legacyConf):
             return
 
-        config = ConfigParser()
-        config.read(self.spoolConf)
+        self.log.info('Adopting legacy spool')
+
+        legacy = ConfigParser()
+        legacy.read(legacyConf)
+
+        id = self.journal.create()
+        dirname = self.journal.dirname(id)
+
+        config = ConfigParser(legacy.defaults())
+        names = []
+
+        for filename in sorted(glob.glob(os.path.join(self.spoolDir,'*'))):
+            if not os.path.isfile(filename) or filename==self.journal.filename:
+                continue
+            name = os.path.basename(filename)
+            os.rename(filename,os.path.join(dirname,name))
+            names.append(name)
+            if legacy.has_section(filename):
+                section = os.path.join(dirname,name)
+                config.add_section(section)
+                for key,value in legacy.items(section=filename):
+                    config.set(section,key,value)
+
+        config.set('DEFAULT','spool.files','\n'.join(names))
+
+        output = open(os.path.join(dirname,'spool.conf'),'w')
+        config.write(output)
+        syncFile(output)
+        output.close()
+
+        sources = legacy.defaults().get('filenames','').split('\n')
+        self.journal.spooled(id,[x for x in sources if os.path.exists(x)])
+        # Always resumed before, so mark it as started
+        self.journal.posted(id,['legacy'])
+
+        os.remove(legacyConf)
+
+    def dropSpool(self,id):
+
+        config = self.spoolConfig(id)
 
-        if len(config.sections())>1:    # implies we have a chunked file
+        for mode,name,checksum,key in self.stagedEntries(config):
+            self.deltaStore.discard(name)
+
+        self.journal.done(id)
+
+    def sendSpool(self,id):
+
+        config = self.spoolConfig(id)
+        files = self.spoolFiles(id)
+
+        # Nothing made it into the spool. Leave the originals and the
+        # journal entry alone and let the caller decide.
+
+        if not files:
+            self.log.error('Nothing to send in spool %d' % id)
+            return False
+
+        if config.sections():           # implies we have a chunked file
             for filename in files:
-                self.postFiles([filename],config)
-        else:
-            self.postFiles(files,config)
+                self.postFiles(id,[filename],config)
+        elif files:
+            self.postFiles(id,files,config)
+
+        # The staged versions become delta bases once the ground
+        # acknowledges them
+
+        self.deltaStore.sent(self.stagedEntries(config))
 
         # Remove original files if successfully sent
 
         for filename in config.get('DEFAULT','filenames').split('\n'):
+            if not filename:
+                continue
             try:
                 os.remove(filename)
             except:
                 self.log.exception('Failed to remove: %s' % filename)
 
-        os.remove(self.spoolConf)
+        self.journal.done(id)
+
+        return True
+
+    def postFiles(self,id,filenames,config):
+
+        if len(filenames)==1 and config.has_section(filenames[0]):
+            headers = dict(config.items(filenames[0]))
+        else:
+            headers = dict(config.items('DEFAULT'))
+
+        headers.pop('delta.staged',None)
+        headers.pop('spool.files',None)
+
+        names = [os.path.basename(x) for x in filenames]
+
+        # Already posted before a restart: only the cleanup is left
+
+        if [x for x in names if not self.journal.isPosted(id,x)]:
+            self.postArticle(filenames,headers)
+            self.journal.posted(id,names)
+
+        for filename in filenames:
+            if not os.path.exists(filename):
+                continue
+            if 'x-transport-part' in headers:
+                self.chunkLock.acquire()
+                try:
+                    self.chunkStore.retain(filename,headers)
+                finally:
+                    self.chunkLock.release()
+            else:
+                os.remove(filename)
+
+    def postArticle(self,filenames,headers):
 
-    def postFiles(self,filenames,config):
+        headers = dict(headers)
+        encoding = headers.pop('spool.encoding','base64')
 
-        self.log.info('    posting files: %d' % len(filenames))
+        self.log.info('    posting files: %d (%s)' % (len(filenames),encoding))
 
         numBytes = 0
 
@@ -514,18 +1716,15 @@ class WorkerThread(Thread, AccessMixin):
             numBytes = numBytes+filesize
             self.log.info('      %s (%d/%d)' % (filename,filesize,numBytes))
 
-        if len(filenames)==1 and config.has_section(filenames[0]):
-            headers = dict(config.items(filenames[0]))
-        else:
-            headers = dict(config.items('DEFAULT'))
-
         starttime = datetime.now()
 
         while self.running:
             try:
-                msgBytes = self.poster.post(filenames,headers=headers)
+                msgBytes = self.poster.post(filenames,headers=headers,
+                                            encoding=encoding)
                 self.totalBytesOut += msgBytes
                 self.totalDataBytesOut += numBytes
+                self.postBytes += msgBytes
                 break
             except nntplib.NNTPTemporaryError,desc:
                 if '441 No valid newsgroups' in str(desc):
@@ -533,113 +1732,506 @@ class WorkerThread(Thread, AccessMixin):
                 else:
                     raise
 
-        for filename in filenames:
-            os.remove(filename)
-
         elapsed = datetime.now()-starttime
         secs = datefunc.timedelta_as_seconds(elapsed)
         rate = int(numBytes/secs*8)
         self.log.info('      %.1f secs, %d bytes, %d bps' % (secs,numBytes,rate))
 
-    def clearSpool(self):
+        self.postSecs += secs
+
+    def unstageDeltas(self,staged,mark):
+        for entry in staged[mark:]:
+            mode,name,checksum,key = entry.split(' ',3)
+            self.deltaStore.discard(name)
+        del staged[mark:]
+
+    def deltaFile(self,id,filename,basename,group,staged):
+
+        # Returns the name of the file to spool and its basename,
+        # which is either the original or a delta against the last
+        # version the ground acknowledged. Each version is staged
+        # under its own name, so a later failure in the same
+        # fileset only unstages its own.
+
+        if os.path.getsize(filename)>group.deltaMaxSize:
+            return filename,basename
+
+        key = group.logicalName(basename)
+        target = open(filename,'rb').read()
+        name = self.deltaStore.stagedName(key,id,len(staged))
+        base = self.deltaStore.get(key)
+        numDeltas = self.deltaStore.numDeltas(key)
+
+        # Earlier versions in this fileset go in the same article, so
+        # later ones can chain from them
+
+        for entry in staged:
+            stagedMode,stagedName,checksum,stagedKey = entry.split(' ',3)
+            if stagedKey==key:
+                base = self.deltaStore.getStaged(stagedName)
+                numDeltas += 1
+
+        self.deltaStore.stage(name,target)
+
+        mode = 'full'
+        delta = None
+
+        if base is None:
+            self.log.info('      no delta base for %s' % key)
+        elif numDeltas>=group.deltaMaxChain:
+            self.log.info('      sending full version of %s' % key)
+        else:
+            try:
+                delta = rdelta.makeDelta(base,target,group.deltaBlockSize)
+            except:
+                self.log.exception('Failed to make delta for %s' % filename)
+
+        if delta is not None:
+            self.log.info('      delta %s: %d -> %d bytes' % \
+                            (basename,len(target),len(delta)))
+            if len(delta)<group.deltaThreshold*len(target):
+                mode = 'delta'
+
+        staged.append('%s %s %s %s' % (mode,name,md5.new(target).hexdigest(),key))
+
+        if mode=='full':
+            return filename,basename
+
+        deltaname = os.path.join(self.spoolRoot,'delta.tmp')
+        output = open(deltaname,'wb')
+        output.write(delta)
+        output.close()
+
+        return deltaname,basename+'.delta'
+
+    def getCompressor(self,codec):
+
+        if codec not in self.compressors:
+            self.compressors[codec] = BlockCompressor(codec,
+                                        blockSize=self.compressBlockSize,
+                                        workers=self.compressWorkers)
+
+        return self.compressors[codec]
+
+    def closeCompressors(self):
+
+        # The worker pools are kept for the rest of the transfer
+
+        for compressor in self.compressors.values():
+            compressor.close()
 
-        stalefiles = glob.glob(os.path.join(self.spoolDir,'*'))
+    def selectCodec(self,filename,group):
 
-        for stalefile in stalefiles:
-            os.remove(stalefile)
+        if group.codec!='auto':
+            return group.codec
 
-    def splitFile(self,basename,data,config,maxSize):
+        input = open(filename,'rb')
+        sample = input.read(group.sampleSize)
+        input.close()
 
-        checksum = md5.new()
+        codec,ratios = pcompress.chooseCodec(sample,group.candidates,
+                                             group.threshold)
+
+        trials = ['%s=%.2f' % (key,ratios[key]) for key in sorted(ratios)]
+
+        self.log.info('      codec %s (%s)' % (codec,' '.join(trials)))
+
+        return codec
+
+    def spoolFile(self,filename,output,codec):
+
+        input = open(filename,'rb')
+
+        if codec!='none':
+            blocks = self.getCompressor(codec).compress(input)
+        else:
+            blocks = iter(lambda: input.read(self.blockSize),'')
+
+        try:
+            for data in blocks:
+                output.write(data)
+        finally:
+            input.close()
+            output.close()
+
+    def splitFile(self,basename,output,config):
 
         config.set('DEFAULT','X-Transport-Filename',basename)
 
-        numChunks = int(math.ceil(len(data)/float(maxSize)))
+        numChunks = len(output.filenames)
 
-        for chunk in range(numChunks):
-            start = chunk*maxSize
-            bytes = data[start:start+maxSize]
-            chunkname = os.path.join(self.spoolDir,'chunk.%04d' % chunk)
-            open(chunkname,'wb').write(bytes)
-            checksum.update(bytes)
+        for chunk,chunkname in enumerate(output.filenames):
             config.add_section(chunkname)
             part = '%d/%d' % (chunk,numChunks)
             config.set(chunkname,'X-Transport-Part',part)
+            checksum = output.checksums[chunk].hexdigest()
+            config.set(chunkname,'X-Transport-Part-MD5',checksum)
 
-        config.set('DEFAULT','X-Transport-MD5',checksum.hexdigest())
+        config.set('DEFAULT','X-Transport-MD5',output.checksum.hexdigest())
 
         self.log.info('      split into %d parts' % numChunks)
 
+    def codecHeader(self,codecs):
+
+        # Single codec name if all files agree, otherwise a list
+        # of filename:codec pairs.
+
+        names = set([codec for basename,codec in codecs])
+
+        if len(names)==1:
+            return names.pop()
+
+        return ' '.join(['%s:%s' % entry for entry in codecs])
+
     def copyToSpool(self,filenames,group):
 
+        # Returns the journal id of the spooled fileset
+
+        id = self.journal.find(filenames)
+
+        if id is not None:
+            self.log.info('    reusing spooled output %d' % id)
+            return id
+
+        id = self.journal.create()
+
+        try:
+            self.writeSpool(id,filenames,group)
+        except:
+            self.journal.discard(id)
+            raise
+
+        self.journal.spooled(id,filenames)
+
+        return id
+
+    def writeSpool(self,id,filenames,group):
+
         config = ConfigParser()
         config.set('DEFAULT','Newsgroups',group.newsgroup)
 
-        if not os.path.exists(self.spoolDir):
-            os.makedirs(self.spoolDir)
+        spoolDir = self.journal.dirname(id)
+
+        split = group.maxFiles==1 and group.maxSize
+        codecs = []
+        deltas = []
+        versions = []
+        staged = []
+        spooled = []
+        sources = []
 
         for filename in filenames:
 
             basename = os.path.basename(filename)
+            source = filename
+            mark = len(staged)
 
             try:
-                data = open(filename).read()
+                if group.delta:
+                    source,basename = self.deltaFile(id,filename,basename,
+                                                     group,staged)
+                codec = self.selectCodec(source,group)
             except:
                 self.log.exception('Failed to read %s' % filename)
+                self.unstageDeltas(staged,mark)
                 continue
 
-            if group.compressFiles:
-                config.set('DEFAULT','X-Transport-Compress','True')
-                data = bz2.compress(data)
-                basename+='.bz2'
+            if source!=filename:
+                deltas.append(basename)
+
+            if codec!='none':
+                basename+=pcompress.extension(codec)
 
-            if group.maxFiles==1 and group.maxSize:
-                self.splitFile(basename,data,config,group.maxSize)
+            if split:
+                output = ChunkWriter(spoolDir,group.maxSize)
             else:
-                destname = os.path.join(self.spoolDir,basename)
-                output = open(destname,'w')
-                output.write(data)
-                output.close()
+                output = SpoolWriter(os.path.join(spoolDir,basename))
+
+            if codec!='none':
+                cpuStart = self.getCompressor(codec).cpuTime
+
+            try:
+                self.spoolFile(source,output,codec)
+            except:
+                self.log.exception('Failed to read %s' % filename)
+                output.remove()
+                self.unstageDeltas(staged,mark)
+                continue
+
+            if codec!='none':
+                srcSize = os.path.getsize(source)
+                self.log.info('      %s: %s %d -> %d bytes, saved %d, %.2f cpu secs' % \
+                    (basename,codec,srcSize,output.numBytes,
+                     srcSize-output.numBytes,
+                     self.getCompressor(codec).cpuTime-cpuStart))
+
+            codecs.append((basename,codec))
+
+            if len(staged)>mark:
+                versions.append('%s:%s' % (basename,staged[-1].split(' ')[2]))
+            spooled.extend([os.path.basename(x) for x in output.filenames])
+
+            if split:
+                self.splitFile(basename,output,config)
+
+            if source!=filename:
+                os.remove(source)
+
+            sources.append(filename)
+
+        if not sources:
+            raise IOError('No files could be spooled')
+
+        # X-Transport-Compress: True still means every file is bz2,
+        # which is all the ground side understood before codecs.
+
+        names = set([codec for basename,codec in codecs])
+
+        if names and names!=set(['none']):
+            config.set('DEFAULT','X-Transport-Codec',self.codecHeader(codecs))
+
+        if names==set(['bz2']):
+            config.set('DEFAULT','X-Transport-Compress','True')
+
+        if deltas:
+            config.set('DEFAULT','X-Transport-Delta',' '.join(deltas))
+
+        if versions:
+            config.set('DEFAULT','X-Transport-Delta-MD5',' '.join(versions))
+
+        if staged:
+            config.set('DEFAULT','delta.staged','\n'.join(staged))
+
+        # Only the originals that were spooled are removed once sent
 
         if group.removeFiles:
-            config.set('DEFAULT','filenames','\n'.join(filenames))
+            config.set('DEFAULT','filenames','\n'.join(sources))
         else:
-            config.get('DEFAULT','filenames','')
+            config.set('DEFAULT','filenames','')
 
-        output = open(self.spoolConf,'w')
-        config.write(output)
-        output.close()
+        config.set('DEFAULT','spool.files','\n'.join(spooled))
+        config.set('DEFAULT','spool.encoding',group.encoding)
+
+        try:
+            output = open(os.path.join(spoolDir,'spool.conf'),'w')
+            config.write(output)
+            syncFile(output)
+            output.close()
+        except:
+            self.unstageDeltas(staged,0)
+            raise
+
+    def pendingFilesets(self,groups,seen):
+
+        # Filesets for any files in groups not already in seen
+
+        filesets = []
+
+        if self.catalog:
+            self.catalog.refresh()
+
+        for group in groups:
+
+            files = []
+            stats = {}
+
+            if self.catalog:
+                for filename,size,mtime in self.catalog.listFiles(group):
+                    if filename not in seen:
+                        files.append(filename)
+                        stats[filename] = (size,mtime)
+            else:
+                for filespec in group.filespecs:
+                    filelist = [x for x in glob.glob(filespec) if x not in seen]
+                    files.extend(filelist)
+
+            if not files:
+                continue
+
+            seen.update(files)
+
+            for fileset in group.partitionFiles(sorted(files),stats):
+                try:
+                    filesets.append(FileSet(group,fileset,stats))
+                except OSError:
+                    self.log.exception('Problem with fileset')
+
+        now = datetime.now()
+        filesets.sort(key=lambda x: x.sortKey(now))
+
+        return filesets
+
+    def checkArrivals(self,queue,seen):
+
+        # Yield to new filesets from groups with a higher priority
+        # than the next one in the queue.
+
+        if queue:
+            priority = queue[0].group.priority
+            groups = [x for x in self.groups if x.priority<priority]
+        else:
+            groups = self.groups
+
+        arrivals = self.pendingFilesets(groups,seen)
+
+        if arrivals:
+            self.log.info('    %d new filesets arrived' % len(arrivals))
+            now = datetime.now()
+            queue.extend(arrivals)
+            queue.sort(key=lambda x: x.sortKey(now))
 
     def sendOutbound(self):
         self.log.info('  * Processing outbound messages')
 
-        for group in self.groups:
+        starttime = datetime.now()
+        seen = set()
+        sent = []
+        deferred = []
+        numBytes = 0
+
+        queue = self.pendingFilesets(self.groups,seen)
 
-            self.log.info('     group: %s' % group.name)
+        self.log.info('    %d filesets pending' % len(queue))
 
-            files = []
+        while queue:
+
+            if not self.isRunning():
+                reason = 'stopped'
+            elif self.budgetTime and datetime.now()-starttime>self.budgetTime:
+                reason = 'budget.time'
+            else:
+                reason = None
+
+            if reason:
+                for fileset in queue:
+                    fileset.reason = reason
+                deferred.extend(queue)
+                break
+
+            fileset = queue.pop(0)
+            group = fileset.group
+
+            if self.budgetBytes and numBytes+fileset.size>self.budgetBytes:
+                fileset.reason = 'budget.bytes'
+                deferred.append(fileset)
+                continue
+
+            self.log.info('     group: %s (priority %d)' % \
+                            (group.name,group.priority))
+
+            for name in fileset.filenames:
+                self.log.info('    %s' % name)
+
+            # Don't bother spooling if nothing more fits in the call
 
-            for filespec in group.filespecs:
-                filelist = glob.glob(filespec)
-                files.extend(filelist)
-                self.log.info('    %s: %d files' % (filespec, len(filelist)))
+            if not self.fitsWindow(0):
+                self.log.info('    no time left in the call window')
+                fileset.reason = 'airtime'
+                deferred.append(fileset)
+                continue
 
-            filesets = group.partitionFiles(sorted(files))
+            try:
+                id = self.copyToSpool(fileset.filenames, group)
+            except:
+                self.log.exception('Problem moving files to spool')
+                continue
 
-            self.log.info('    partitioned into %d sets' % len(filesets))
+            wireBytes = self.spoolBytes(id)
 
+            if not self.fitsWindow(wireBytes):
+                self.log.info('    not enough time left for %d bytes' % wireBytes)
+                # The spooled output is left to be reused next time
+                fileset.reason = 'airtime'
+                deferred.append(fileset)
+                continue
+
+            if not self.sendSpool(id):
+                # Spool it again from the originals next time
+                self.dropSpool(id)
+                fileset.reason = 'failed'
+                deferred.append(fileset)
+                continue
+
+            numBytes += fileset.size
+            sent.append(fileset)
+
+            self.checkArrivals(queue,seen)
+
+        self.log.info('    sent %d filesets, deferred %d' % \
+                        (len(sent),len(deferred)))
+
+        self.expireSpools(deferred)
+
+        try:
+            self.saveReport(starttime,sent,deferred)
+        except:
+            self.log.exception('Problem saving report')
+
+    def expireSpools(self,deferred):
+
+        # Drop unstarted spools that no deferred fileset will reuse,
+        # such as when the files have since been grouped differently
+        # (find() needs an exact match) or removed.
+
+        keep = set()
+
+        for fileset in deferred:
+            try:
+                id = self.journal.find(fileset.filenames)
+            except OSError:
+                continue
+            if id is not None:
+                keep.add(id)
+
+        for id in self.journal.live():
+            if not self.journal.started(id) and id not in keep:
+                self.log.info('    dropping unused spool %d' % id)
+                self.dropSpool(id)
+
+    def saveReport(self,starttime,sent,deferred):
+
+        template = self.get('filename.report')
+
+        if not template:
+            return
+
+        now = datetime.now()
+        report = ConfigParser()
+
+        report.set('DEFAULT','time.start',str(starttime))
+        report.set('DEFAULT','time.stop',str(now))
+        report.set('DEFAULT','sent.filesets',str(len(sent)))
+        report.set('DEFAULT','sent.bytes',str(sum([x.size for x in sent])))
+        report.set('DEFAULT','deferred.filesets',str(len(deferred)))
+        report.set('DEFAULT','deferred.bytes',str(sum([x.size for x in deferred])))
+        report.set('DEFAULT','call.window',str(self.callWindow))
+        report.set('DEFAULT','signal',str(self.signal))
+        report.set('DEFAULT','predicted.bps',str(self.predictedRate))
+        report.set('DEFAULT','actual.bps',str(self.actualRate()))
+
+        for label,filesets in [('sent',sent),('deferred',deferred)]:
             for k,fileset in enumerate(filesets):
-                self.log.info('    File set %s' % k)
-                for name in fileset:
-                    self.log.info('    %s' % name)
-                try:
-                    self.clearSpool()
-                    self.copyToSpool(fileset, group)
-                except:
-                    self.log.exception('Problem moving files to spool')
-                    continue
+                section = '%s-%d' % (label,k)
+                report.add_section(section)
+                report.set(section,'group',fileset.group.name)
+                report.set(section,'priority',str(fileset.group.priority))
+                report.set(section,'files',str(len(fileset.filenames)))
+                report.set(section,'bytes',str(fileset.size))
+                report.set(section,'age',str(fileset.age(now)))
+                report.set(section,'overdue',str(fileset.overdue(now)))
+                if fileset.reason:
+                    report.set(section,'reason',fileset.reason)
+
+        filename = starttime.strftime(template)
+        dirname  = os.path.dirname(filename)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
 
-                self.sendSpool()
+        self.log.info('    - writing report: %s' % filename)
+
+        output = open(filename,'w')
+        report.write(output)
+        output.close()
 
 class Server(ProcessClient, XMLRPCServerMixin):
 
@@ -655,6 +2247,7 @@ class Server(ProcessClient, XMLRPCServerMixin):
         self.register_function(self.start)
         self.register_function(self.stop)
         self.register_function(self.busy)
+        self.register_function(self.history)
 
         self.log.info('Connecting to RUDICS on port %s' % self.rudicsPort)
 
@@ -674,6 +2267,9 @@ class Server(ProcessClient, XMLRPCServerMixin):
     def busy(self):
         return self.runRequest.isSet()
 
+    def history(self):
+        return self.worker.history.load()
+
     def stop(self):
         self.runRequest.clear()
         return 1
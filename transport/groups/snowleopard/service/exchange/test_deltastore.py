@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Tests for deltastore.py
+#
+#       python test_deltastore.py
+#
+#   2026-10-19  Initial implementation
+#
+####################################################################
+
+from deltastore import DeltaStore
+
+import os
+import md5
+import shutil
+import logging
+import tempfile
+import unittest
+
+class DeltaStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = DeltaStore(self.path,1024*1024,logging)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def stage(self,key,id,data):
+        name = self.store.stagedName(key,id,0)
+        self.store.stage(name,data)
+        return ('full',name,md5.new(data).hexdigest(),key)
+
+    def pending(self):
+        return self.store.loadConfig(self.store.pendingFile)
+
+    def testSentTwice(self):
+
+        # A spool resumed after a restart posts the same versions again
+
+        entry = self.stage('system/a-#.dat',1,'version 1')
+
+        self.store.sent([entry])
+        seq = self.pending().getint(entry[1],'seq')
+
+        self.store.sent([entry])
+
+        pending = self.pending()
+        self.assertEqual(pending.sections(),[entry[1]])
+        self.assertEqual(pending.getint(entry[1],'seq'),seq)
+
+        self.assertTrue(self.store.acknowledge(entry[2]))
+        self.assertEqual(self.store.get('system/a-#.dat'),'version 1')
+        self.assertEqual(self.pending().sections(),[])
+
+    def testSentAfterAcknowledge(self):
+
+        # The staged file became the base, so there is nothing to send
+
+        entry = self.stage('system/a-#.dat',1,'version 1')
+
+        self.store.sent([entry])
+        self.store.acknowledge(entry[2])
+        self.store.sent([entry])
+
+        self.assertEqual(self.pending().sections(),[])
+        self.assertEqual(self.store.get('system/a-#.dat'),'version 1')
+
+    def testSentChanged(self):
+
+        # The same name restaged with other contents replaces the entry
+
+        entry = self.stage('system/a-#.dat',1,'version 1')
+        self.store.sent([entry])
+
+        entry = self.stage('system/a-#.dat',1,'version 2')
+        self.store.sent([entry])
+
+        pending = self.pending()
+        self.assertEqual(pending.sections(),[entry[1]])
+        self.assertEqual(pending.get(entry[1],'md5'),entry[2])
+
+if __name__ == '__main__':
+    unittest.main()
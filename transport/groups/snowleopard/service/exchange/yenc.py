@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   yEnc encoding
+#
+#   Binary attachments are sent 8 bits per byte instead of base64's
+#   6, adding about 2% instead of 33%. Each byte is offset by 42
+#   and only the characters NNTP can't carry in a line (NUL, CR,
+#   LF) plus the escape character itself are escaped, as '=' and
+#   the character offset by 64. Tab and space at the start or end
+#   of a line and a leading dot are escaped too, so that nothing
+#   along the way strips or un-stuffs them.
+#
+#   An encoded part looks like:
+#
+#       =ybegin line=128 size=<bytes> name=<filename>
+#       <encoded lines>
+#       =yend size=<bytes> crc32=<hex>
+#
+#   and is sent as a MIME part with Content-Transfer-Encoding
+#   x-yenc.
+#
+#   2026-10-19  Initial implementation
+#
+####################################################################
+
+import re
+import zlib
+
+LineLength  = 128
+
+EncodeTable = ''.join([chr((x+42)%256) for x in range(256)])
+DecodeTable = ''.join([chr((x-42)%256) for x in range(256)])
+
+Critical    = re.compile('[\x00\n\r=]')
+Escapes     = dict([(chr(x),'='+chr((x+64)%256)) for x in range(256)])
+
+class YencError(Exception):
+    pass
+
+def escape(match):
+    return Escapes[match.group()]
+
+def escapeLine(line):
+
+    if line[0] in ' \t.':
+        line = Escapes[line[0]]+line[1:]
+
+    if line[-1] in ' \t':
+        line = line[:-1]+Escapes[line[-1]]
+
+    return line
+
+class Encoder:
+
+    # Incremental encoder, data can be passed in any size blocks
+
+    def __init__(self,name,size,lineLength=LineLength):
+        self.name       = name
+        self.size       = size
+        self.lineLength = lineLength
+        self.crc        = 0
+        self.numBytes   = 0
+        self.pending    = ''
+
+    def begin(self):
+        return '=ybegin line=%d size=%d name=%s\n' % \
+                (self.lineLength,self.size,self.name)
+
+    def encode(self,data):
+
+        # Returns a list of complete lines
+
+        self.crc = zlib.crc32(data,self.crc)
+        self.numBytes += len(data)
+
+        encoded = self.pending+Critical.sub(escape,data.translate(EncodeTable))
+
+        lines = []
+        pos = 0
+
+        while len(encoded)-pos>self.lineLength:
+            end = pos+self.lineLength
+            # Don't split an escape pair across lines
+            if encoded[end-1]=='=':
+                end += 1
+            lines.append(escapeLine(encoded[pos:end])+'\n')
+            pos = end
+
+        self.pending = encoded[pos:]
+
+        return lines
+
+    def end(self):
+
+        lines = []
+
+        if self.pending:
+            lines.append(escapeLine(self.pending)+'\n')
+            self.pending = ''
+
+        if self.numBytes!=self.size:
+            raise YencError('Size changed while encoding %s' % self.name)
+
+        lines.append('=yend size=%d crc32=%08x\n' % \
+                        (self.numBytes,self.crc & 0xffffffff))
+
+        return lines
+
+def encodeFile(fp,name,size,blockSize=64*1024):
+
+    # Generator over the encoded lines of an open file
+
+    encoder = Encoder(name,size)
+
+    yield encoder.begin()
+
+    while True:
+        data = fp.read(blockSize)
+        if not data:
+            break
+        for line in encoder.encode(data):
+            yield line
+
+    for line in encoder.end():
+        yield line
+
+def parseKeywords(line):
+
+    # =ybegin line=128 size=100 name=file name.bin -> dict
+    # The name is always last and can contain spaces.
+
+    fields = {}
+    text = line.split(' ',1)[1]
+
+    if ' name=' in ' '+text:
+        text,name = (' '+text).split(' name=',1)
+        fields['name'] = name.strip()
+
+    for entry in text.split():
+        if '=' in entry:
+            key,value = entry.split('=',1)
+            fields[key] = value
+
+    return fields
+
+def decode(text):
+
+    # Returns (name,data) for an encoded part
+
+    lines = text.splitlines()
+
+    try:
+        start = [x.startswith('=ybegin ') for x in lines].index(True)
+        stop  = [x.startswith('=yend') for x in lines].index(True)
+    except ValueError:
+        raise YencError('Missing =ybegin or =yend line')
+
+    header  = parseKeywords(lines[start])
+    trailer = parseKeywords(lines[stop])
+
+    parts = ''.join(lines[start+1:stop]).split('=')
+    output = [parts[0]]
+
+    for part in parts[1:]:
+        if not part:
+            raise YencError('Escape at end of data')
+        output.append(chr((ord(part[0])-64)%256)+part[1:])
+
+    data = ''.join(output).translate(DecodeTable)
+
+    if len(data)!=int(header['size']):
+        raise YencError('Size mismatch: %d != %s' % (len(data),header['size']))
+
+    if 'crc32' in trailer:
+        crc = zlib.crc32(data) & 0xffffffff
+        if crc!=int(trailer['crc32'],16):
+            raise YencError('CRC mismatch')
+
+    return header.get('name'),data
@@ -18,6 +18,62 @@
 #   2010-03-16  Todd Valentic
 #               Remove need to explicitly list users
 #
+#   2026-10-19  Coalesce allocation requests. Each allocate updates
+#                   the scoreboard and waits for a reconcile, which
+#                   is run by a separate thread once the requests
+#                   have stopped arriving for reconcile.debounce
+#                   seconds, so a burst of requests shares one status
+#                   read and rollup. The status is cached for
+#                   status.maxage seconds and thrown away whenever we
+#                   run a state change command.
+#
+#   2026-10-19  Keep the rollup up to date as requests change. The
+#                   scoreboard counts the requests for each state of
+#                   each resource parameter and only resources whose
+#                   selected state changed are reconciled, plus all
+#                   of them whenever the status has been read fresh.
+#
+#   2026-10-19  Run the transitions for different resources in
+#                   parallel (transition.workers threads). A resource
+#                   listing others in resource.<name>.after is turned
+#                   on after them and off before them. The time taken
+#                   by each transition is recorded (see latency()).
+#                   A state change command exiting with a non-zero
+#                   status fails the transition.
+#
+#   2026-10-19  Measure how long resources take to warm up and let
+#                   monitors reserve resources ahead of a sample.
+#
+#                   A resource with a ready.command is polled after
+#                   being turned on until the command succeeds, so
+#                   allocate() returns once the device is usable.
+#                   The time from the start of the transition until
+#                   then is kept as the resource's warm up time.
+#
+#                   reserve(monitor,resources,delay) asks for the
+#                   resources to be on delay seconds from now. They
+#                   are allocated for the monitor ahead of that by
+#                   the expected warm up time (measured, or the
+#                   resource's warmup setting) plus reservation.margin.
+#                   The reservation is held in the scoreboard under
+#                   <monitor>.reserve, so it adds to whatever the
+#                   monitor has allocated rather than replacing it.
+#                   When the monitor then allocates the same thing
+#                   nothing needs to change. A reservation the monitor
+#                   doesn't take up is released reservation.hold
+#                   seconds after the requested time.
+#
+#   2026-10-19  The background.delay alarm only sets a flag. The
+#                   reconciler thread checks it each time round its
+#                   loop and applies background.state.main, since
+#                   allocate() takes locks and waits on the reconciler
+#                   and so can't be called from a signal handler.
+#
+#   2026-10-19  Handle each XML-RPC request in its own thread, as the
+#                   cache service does, so allocations waiting on the
+#                   reconciler can coalesce and status(), cancel()
+#                   and reservations() aren't held up behind them.
+#
 ###########################################################
 
 from Transport      import ProcessClient
@@ -26,12 +82,15 @@ from Transport      import AccessMixin
 from Transport      import ConfigComponent
 from Transport.Util import PatternTemplate
 from Transport.Util import datefunc
+from threading      import Thread, Condition, Lock
+from SocketServer   import BaseServer, ThreadingMixIn
 
 import sys
 import ConfigParser
 import StringIO
 import commands
 import signal
+import time
 
 class ResourceState(ConfigComponent):
 
@@ -61,12 +120,20 @@ class Resource(ConfigComponent):
         self.default    = self.get('default.state',self.order[-1])
         self.section    = self.get('status.section','DEFAULT')
         self.key        = self.get('status.key','')
+        self.after      = set(self.getList('after'))
+
+        self.readyCommand   = self.get('ready.command')
+        self.readyTimeout   = self.getfloat('ready.timeout',120)
+        self.readyInterval  = self.getfloat('ready.interval',1)
+        self.warmup         = self.getfloat('warmup',0)
 
         if not self.params:
             self.params.add('')
 
         self.replaceParam = PatternTemplate('param')
 
+        self.rank = dict([(state,index) for index,state in enumerate(self.order)])
+
         if self.reset not in self.order:
             ValueError('Unknown reset.state (%s) for %s' % (self.reset,name))
 
@@ -97,33 +164,24 @@ class Resource(ConfigComponent):
     def resetState(self):
         return (self.params,self.reset)
 
-    def rollup(self,entries):
-
-        paramsdict = {}
-
-        for param in self.params:
-            paramsdict[param] = set()
+    def selectState(self,counts):
 
-        for entryparams,state in entries.values():
-            for param in entryparams:
-                paramsdict[param].add(state)
+        # The latest state in the order list with any requests
 
-        result = {}
+        selected = None
 
-        for param,states in paramsdict.items():
-            result[param] = self.selectState(states)
+        for state,count in counts.items():
+            if count and state in self.rank:
+                if selected is None or self.rank[state]>self.rank[selected]:
+                    selected = state
 
-        return result
+        return selected or self.default
 
-    def selectState(self,states):
+    def plan(self,config,entry):
 
-        for state in reversed(self.order):
-            if state in states:
-                return state
+        # List of (param,current,next) state changes needed
 
-        return self.default
-
-    def reconcile(self,config,entry):
+        transitions = []
 
         for param,nextState in entry.items():
 
@@ -134,24 +192,71 @@ class Resource(ConfigComponent):
                 continue
 
             if curState!=nextState:
-                self.log.info('  state change %s[%s] %s -> %s' % \
-                    (self.name,param,curState,nextState))
-                self.runCommand(self.states[nextState].command,param)
-                self.runService(self.states[nextState].service,param)
+                transitions.append((param,curState,nextState))
+
+        return transitions
+
+    def isShutdown(self,transitions):
+        return not [x for x in transitions if x[2]!=self.reset]
+
+    def apply(self,transitions):
+
+        for param,curState,nextState in transitions:
+            self.log.info('  state change %s[%s] %s -> %s' % \
+                (self.name,param,curState,nextState))
+            startTime = time.time()
+            self.runCommand(self.states[nextState].command,param)
+            self.runService(self.states[nextState].service,param)
+            self.parent.recordLatency(self.name,param,curState,nextState,
+                                      time.time()-startTime)
+
+            # Only a ready.command tells us when it has warmed up
+
+            if nextState!=self.reset and self.readyCommand:
+                self.waitReady(param)
+                self.parent.recordLatency(self.name,'','','warmup',
+                                          time.time()-startTime)
+
+    def waitReady(self,param):
+
+        cmd = self.replaceParam(self.readyCommand,param)
+        endTime = time.time()+self.readyTimeout
+
+        while True:
+            status,output = commands.getstatusoutput(cmd)
+            if status==0:
+                return
+            if time.time()>endTime:
+                raise IOError('%s not ready after %ds' % \
+                    (self.name,self.readyTimeout))
+            time.sleep(self.readyInterval)
 
     def runCommand(self,cmd,param):
 
         if not cmd:
             return
 
+        self.parent.invalidateStatus()
+
         cmd = self.replaceParam(cmd,param)
         status,output = commands.getstatusoutput(cmd)
 
+        # Failing the transition skips the resources that depend on it
+
+        if status!=0:
+            self.log.error('State change command failed for %s' % self.name)
+            self.log.error('  command: %s' % cmd)
+            self.log.error('  status:  %s' % status)
+            self.log.error('  output:  %s' % output)
+            raise IOError('Failed to run %s' % cmd)
+
     def runService(self,cmd,param):
 
         if not cmd:
             return
 
+        self.parent.invalidateStatus()
+
         cmd = self.replaceParam(cmd,param).split()
         serviceName,function,args = cmd[0],cmd[1],cmd[2:]
 
@@ -170,17 +275,62 @@ class ScoreBoard(AccessMixin):
 
     def reset(self):
 
+        # map:      resource -> user -> (params,state)
+        # counts:   resource -> param -> state -> number of users
+        # selected: resource -> param -> rolled up state
+        # dirty:    resources whose selected state has changed
+
         self.map = {}
+        self.counts = {}
+        self.selected = {}
+        self.dirty = set()
 
         for resource in self.resources.values():
             self.map[resource.name] = {}
+            self.counts[resource.name] = {}
+            self.selected[resource.name] = {}
+            for param in resource.params:
+                self.counts[resource.name][param] = {}
+                self.selected[resource.name][param] = resource.default
+            self.dirty.add(resource.name)
+
+    def count(self,resource,entry,delta):
+
+        params,state = entry
+        counts = self.counts[resource]
+
+        for param in params:
+            if param not in counts:
+                continue
+            counts[param][state] = counts[param].get(state,0)+delta
+            if not counts[param][state]:
+                del counts[param][state]
+
+        return params
+
+    def setEntry(self,resource,user,entry):
+
+        prevEntry = self.map[resource].get(user)
+
+        if prevEntry==entry:
+            return
+
+        self.map[resource][user] = entry
+
+        touched = set(self.count(resource,entry,1))
+
+        if prevEntry:
+            touched.update(self.count(resource,prevEntry,-1))
+
+        for param in touched.intersection(self.counts[resource]):
+            state = self.resources[resource].selectState(self.counts[resource][param])
+            if state!=self.selected[resource][param]:
+                self.selected[resource][param] = state
+                self.dirty.add(resource)
 
     def allocate(self,user,resourceList):
 
-        if user not in self.users:
-            for resource in self.resources.values():
-                self.map[resource.name][user] = resource.resetState()
-                self.users.add(user)
+        self.users.add(user)
 
         requested = {}
         for entry in resourceList:
@@ -203,23 +353,381 @@ class ScoreBoard(AccessMixin):
                 self.log.error('Unknown resource request: %s' % entry)
                 continue
 
+            unknown = params.difference(self.resources[resource].params)
+
+            if unknown:
+                self.log.error('Unknown params %s in request: %s' % \
+                    (' '.join(sorted(unknown)),entry))
+
             requested[resource] = (params,state)
 
         for resource in set(self.resources).difference(requested):
-            self.map[resource][user] = self.resources[resource].resetState()
+            self.setEntry(resource,user,self.resources[resource].resetState())
 
         for resource in requested:
-            self.map[resource][user] = requested[resource]
+            self.setEntry(resource,user,requested[resource])
 
-    def rollup(self):
+    def rollup(self,full=False):
+
+        # Selected states for the resources that have changed since the
+        # last rollup (or all of them)
+
+        if full:
+            names = self.resources.keys()
+        else:
+            names = self.dirty
 
         nextState = {}
 
-        for resource,users in self.map.items():
-            nextState[resource] = self.resources[resource].rollup(users)
+        for resource in names:
+            nextState[resource] = dict(self.selected[resource])
+
+        self.dirty = set()
 
         return nextState
 
+    def markDirty(self,names):
+        self.dirty.update(names)
+
+class TransitionExecutor:
+
+    # Runs a set of tasks on up to maxWorkers threads. Each task waits
+    # for the ones it depends on and is skipped if any of them failed.
+
+    def __init__(self,maxWorkers,log):
+        self.maxWorkers = max(1,maxWorkers)
+        self.log        = log
+
+    def run(self,tasks):
+
+        # tasks: name -> (function,set of names it depends on)
+        # Returns the names of the tasks that failed or were skipped.
+
+        self.tasks      = tasks
+        self.pending    = set(tasks)
+        self.running    = set()
+        self.done       = set()
+        self.failed     = set()
+        self.lock       = Condition()
+
+        numWorkers = min(self.maxWorkers,len(tasks))
+
+        if numWorkers==1:
+            self.worker()
+        else:
+            workers = [Thread(target=self.worker) for x in range(numWorkers)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        return self.failed
+
+    def nextTask(self):
+
+        # Called with the lock held
+
+        while self.pending:
+
+            for name in sorted(self.pending):
+                deps = self.tasks[name][1].intersection(self.tasks)
+                if deps.intersection(self.failed):
+                    self.log.error('Skipping %s, %s failed' % \
+                        (name,' '.join(sorted(deps.intersection(self.failed)))))
+                    self.pending.discard(name)
+                    self.failed.add(name)
+                    self.lock.notifyAll()
+                    break
+                if deps.issubset(self.done):
+                    self.pending.discard(name)
+                    self.running.add(name)
+                    return name
+            else:
+                if not self.running:
+                    self.log.error('Dependency loop between %s' % \
+                        ' '.join(sorted(self.pending)))
+                    self.failed.update(self.pending)
+                    self.pending.clear()
+                    return None
+                self.lock.wait()
+
+        return None
+
+    def worker(self):
+
+        while True:
+
+            self.lock.acquire()
+            try:
+                name = self.nextTask()
+            finally:
+                self.lock.release()
+
+            if name is None:
+                return
+
+            try:
+                self.tasks[name][0]()
+                ok = True
+            except:
+                self.log.exception('Problem changing state of %s' % name)
+                ok = False
+
+            self.lock.acquire()
+            try:
+                self.running.discard(name)
+                if ok:
+                    self.done.add(name)
+                else:
+                    self.failed.add(name)
+                self.lock.notifyAll()
+            finally:
+                self.lock.release()
+
+class Reconciler(Thread):
+
+    # Runs one reconcile for each burst of requests. Requests are
+    # numbered and a run covers every request made before it started,
+    # so each caller can wait for the run that includes its own.
+
+    def __init__(self,parent,debounce,timeout):
+        Thread.__init__(self)
+        self.setDaemon(True)
+
+        self.parent     = parent
+        self.log        = parent.log
+        self.debounce   = debounce
+        self.timeout    = timeout
+
+        self.lock       = Condition()
+        self.requested  = 0
+        self.completed  = 0
+        self.lastRequest = 0
+        self.failed     = []    # (first,last) requests of failed runs
+
+    def request(self):
+
+        self.lock.acquire()
+
+        try:
+            self.requested += 1
+            self.lastRequest = time.time()
+            self.lock.notifyAll()
+            return self.requested
+        finally:
+            self.lock.release()
+
+    def wait(self,request):
+
+        endTime = time.time()+self.timeout
+
+        self.lock.acquire()
+
+        try:
+            while self.completed<request:
+                remaining = endTime-time.time()
+                if remaining<=0:
+                    raise IOError('Timed out waiting for reconcile')
+                self.lock.wait(remaining)
+
+            for first,last in self.failed:
+                if first<=request<=last:
+                    raise IOError('Problem reconciling system state')
+
+        finally:
+            self.lock.release()
+
+    def run(self):
+
+        while True:
+
+            if self.parent.backgroundPending:
+                self.parent.startBackground()
+
+            self.lock.acquire()
+
+            try:
+                if self.completed==self.requested:
+                    # Poll for the background alarm until it has gone off
+                    if self.parent.backgroundWaiting:
+                        self.lock.wait(1)
+                    else:
+                        self.lock.wait()
+                    continue
+
+                # Wait for the burst to finish, but don't let a steady
+                # stream of requests hold things up for long
+
+                startTime = time.time()
+
+                while time.time()-startTime<self.debounce*4:
+                    quiet = time.time()-self.lastRequest
+                    if quiet>=self.debounce:
+                        break
+                    self.lock.wait(self.debounce-quiet)
+
+                first = self.completed+1
+                last = self.requested
+
+            finally:
+                self.lock.release()
+
+            if last>first:
+                self.log.info('Reconciling %d requests together' % \
+                    (last-first+1))
+
+            try:
+                self.parent.reconcile()
+                ok = True
+            except:
+                self.log.exception('Problem reconciling system state')
+                ok = False
+
+            self.lock.acquire()
+
+            try:
+                if not ok:
+                    self.failed = self.failed[-9:]+[(first,last)]
+                self.completed = last
+                self.lock.notifyAll()
+            finally:
+                self.lock.release()
+
+class Reservations(Thread):
+
+    # Starts reserved allocations ahead of time and releases the ones
+    # that weren't taken up.
+
+    def __init__(self,parent,margin,hold):
+        Thread.__init__(self)
+        self.setDaemon(True)
+
+        self.parent     = parent
+        self.log        = parent.log
+        self.margin     = margin
+        self.hold       = hold
+
+        self.lock       = Condition()
+        self.entries    = {}    # monitor -> reservation
+
+    def reserve(self,monitor,resources,delay,warmup):
+
+        # Returns the seconds until the resources will be allocated
+
+        now = time.time()
+        startTime = now+delay
+
+        entry = dict(resources=resources,
+                     prewarm=startTime-warmup-self.margin,
+                     start=startTime,
+                     expires=startTime+self.hold,
+                     active=False)
+
+        self.lock.acquire()
+
+        try:
+            self.entries[monitor] = entry
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+
+        return max(0,entry['prewarm']-now)
+
+    def cancel(self,monitor):
+
+        self.lock.acquire()
+
+        try:
+            return self.entries.pop(monitor,None)
+        finally:
+            self.lock.release()
+
+    def isCurrent(self,monitor,entry):
+
+        self.lock.acquire()
+
+        try:
+            return self.entries.get(monitor) is entry
+        finally:
+            self.lock.release()
+
+    def remove(self,monitor,entry):
+
+        self.lock.acquire()
+
+        try:
+            if self.entries.get(monitor) is entry:
+                del self.entries[monitor]
+        finally:
+            self.lock.release()
+
+    def list(self):
+
+        self.lock.acquire()
+
+        try:
+            now = time.time()
+            results = {}
+            for monitor,entry in self.entries.items():
+                results[monitor] = dict(resources=entry['resources'],
+                                        prewarm=entry['prewarm']-now,
+                                        start=entry['start']-now,
+                                        active=entry['active'])
+            return results
+        finally:
+            self.lock.release()
+
+    def nextAction(self):
+
+        # Returns (monitor,entry,resources) for the next reservation to
+        # start or release, waiting until one is due
+
+        self.lock.acquire()
+
+        try:
+            while True:
+                now = time.time()
+                nextTime = None
+
+                for monitor,entry in self.entries.items():
+                    if not entry['active']:
+                        if now>=entry['prewarm']:
+                            entry['active'] = True
+                            return monitor,entry,entry['resources']
+                        dueTime = entry['prewarm']
+                    else:
+                        if now>=entry['expires']:
+                            return monitor,entry,[]
+                        dueTime = entry['expires']
+                    if nextTime is None or dueTime<nextTime:
+                        nextTime = dueTime
+
+                if nextTime is None:
+                    self.lock.wait()
+                else:
+                    self.lock.wait(nextTime-now)
+        finally:
+            self.lock.release()
+
+    def run(self):
+
+        while True:
+
+            monitor,entry,resources = self.nextAction()
+
+            if resources:
+                self.log.info('Starting reservation for %s' % monitor)
+            else:
+                self.log.info('Releasing unused reservation for %s' % monitor)
+
+            try:
+                self.parent.reserved(monitor,entry,resources)
+            except:
+                self.log.exception('Problem with reservation for %s' % monitor)
+
+            if not resources:
+                self.remove(monitor,entry)
+
 class ResourceMonitor(ProcessClient, XMLRPCServerMixin):
 
     def __init__(self,argv):
@@ -228,62 +736,335 @@ class ResourceMonitor(ProcessClient, XMLRPCServerMixin):
 
         self.register_function(self.status)
         self.register_function(self.allocate)
+        self.register_function(self.latency)
+        self.register_function(self.reserve)
+        self.register_function(self.cancel)
+        self.register_function(self.listReservations,'reservations')
+
+        if not self.makeThreaded():
+            self.log.error('No XML-RPC server found, requests will not coalesce')
 
         self.resources      = self.getComponentsDict('resources',Resource)
         self.statusCommand  = self.get('status.command')
         self.statusService  = self.get('status.service')
 
         self.scoreboard = ScoreBoard(self,self.resources)
+        self.scoreboardLock = Lock()
 
-        self.allocate('background',self.getList('background.state.start'))
+        self.statusMaxAge   = self.getfloat('status.maxage',10)
+        self.statusCache    = None
+        self.statusTime     = 0
+
+        self.latencyLock    = Lock()
+        self.latencies      = {}
+
+        # Set before the reconciler starts, it polls for the alarm
 
         delay = self.getDeltaTime('background.delay',30)
         delay = int(datefunc.timedelta_as_seconds(delay))
 
+        self.backgroundWaiting = delay>0
+        self.backgroundPending = False
+
+        self.executor = TransitionExecutor(self.getint('transition.workers',4),
+                                           self.log)
+
+        self.reconciler = Reconciler(self,
+                                     self.getfloat('reconcile.debounce',0.2),
+                                     self.getfloat('reconcile.timeout',300))
+        self.reconciler.start()
+
+        self.requestLock = Lock()
+
+        self.reservations = Reservations(self,
+                                         self.getfloat('reservation.margin',5),
+                                         self.getfloat('reservation.hold',300))
+        self.reservations.start()
+
+        self.allocate('background',self.getList('background.state.start'))
+
         signal.signal(signal.SIGALRM,self.alarmHandler)
         signal.alarm(delay)
 
+    def makeThreaded(self):
+
+        # allocate() blocks until the reconcile, so each request needs
+        # its own thread. Returns False if the mixin's server can't be
+        # found.
+
+        for value in vars(self).values():
+            if not isinstance(value,BaseServer):
+                continue
+            if not isinstance(value,ThreadingMixIn):
+                self.log.info('Adding a threading mixin to the XML-RPC server')
+                class ThreadingServer(ThreadingMixIn,value.__class__):
+                    daemon_threads = True
+                value.__class__ = ThreadingServer
+            return True
+
+        return False
+
     def alarmHandler(self,signum,frame):
-        self.allocate('background',self.getList('background.state.main'))
+        # Picked up by the reconciler thread (see startBackground)
+        self.backgroundPending = True
+
+    def startBackground(self):
+
+        # Called by the reconciler thread once background.delay is up.
+        # Like allocate(), but doesn't wait for the reconcile, which
+        # runs next in the same thread.
+
+        self.backgroundPending = False
+        self.backgroundWaiting = False
+
+        resources = self.getList('background.state.main')
+
+        self.log.info('allocation request from background')
+        self.log.info('  %s' % resources)
+
+        self.requestLock.acquire()
+
+        try:
+            self.updateScoreboard('background',resources)
+        except:
+            return      # already logged
+        finally:
+            self.requestLock.release()
+
+        self.reconciler.request()
 
     def status(self):
-        return str(self.scoreboard.map)
+        self.scoreboardLock.acquire()
+        try:
+            return str(self.scoreboard.map)
+        finally:
+            self.scoreboardLock.release()
 
     def allocate(self,monitor,resources):
         self.log.info('allocation request from %s' % monitor)
         self.log.info('  %s' % resources)
+
+        # The monitor's own request replaces any reservation
+
+        self.requestLock.acquire()
+
+        try:
+            entry = self.reservations.cancel(monitor)
+            if entry and entry['active']:
+                self.updateScoreboard(self.reserveUser(monitor),[])
+            self.updateScoreboard(monitor,resources)
+        finally:
+            self.requestLock.release()
+
+        self.reconciler.wait(self.reconciler.request())
+
+        return True
+
+    def reserveUser(self,monitor):
+        # Scoreboard user holding a monitor's reservation
+        return monitor+'.reserve'
+
+    def reserved(self,monitor,entry,resources):
+
+        # Called to start or release a reservation, unless the monitor
+        # has made its own request since
+
+        self.requestLock.acquire()
+
+        try:
+            if not self.reservations.isCurrent(monitor,entry):
+                return
+            self.updateScoreboard(self.reserveUser(monitor),resources)
+        finally:
+            self.requestLock.release()
+
+        self.reconciler.wait(self.reconciler.request())
+
+    def updateScoreboard(self,monitor,resources):
+
+        self.scoreboardLock.acquire()
+
         try:
             self.scoreboard.allocate(monitor,resources)
         except:
             self.log.exception('Problem parsing resource request')
             raise
+        finally:
+            self.scoreboardLock.release()
+
+    def expectedWarmup(self,resources):
+
+        # Longest warm up time of the resources in an allocation list
+
+        warmup = 0
+
+        for entry in resources:
+            name = entry.split('=')[0].split('[')[0].strip()
+            if name not in self.resources:
+                continue
+            self.latencyLock.acquire()
+            try:
+                count,total,last,longest = \
+                    self.latencies.get('%s warmup' % name,(0,0,0,0))
+            finally:
+                self.latencyLock.release()
+            if count:
+                warmup = max(warmup,total/count)
+            else:
+                warmup = max(warmup,self.resources[name].warmup)
+
+        return warmup
+
+    def reserve(self,monitor,resources,delay):
+
+        # Have resources ready for monitor in delay seconds. Returns
+        # the number of seconds until they will be allocated.
+
+        warmup = self.expectedWarmup(resources)
+
+        self.log.info('reservation from %s in %ds (warm up %.1fs)' % \
+            (monitor,delay,warmup))
+        self.log.info('  %s' % resources)
+
+        return self.reservations.reserve(monitor,resources,delay,warmup)
+
+    def cancel(self,monitor):
+
+        # Drop a reservation, releasing the resources if it has started
+
+        self.requestLock.acquire()
 
         try:
-            self.reconcile()
-        except:
-            self.log.exception('Problem reconciling system state')
-            raise
+            entry = self.reservations.cancel(monitor)
+            started = entry and entry['active']
+            if started:
+                self.updateScoreboard(self.reserveUser(monitor),[])
+        finally:
+            self.requestLock.release()
 
-        return True
+        if started:
+            self.reconciler.wait(self.reconciler.request())
+
+        return entry is not None
+
+    def listReservations(self):
+        return self.reservations.list()
 
     def reconcile(self):
         self.log.info('Reconciling system state')
 
+        # With a fresh status check everything, to catch any changes
+        # made behind our back. Otherwise just what has changed.
+
+        full = not self.statusValid()
+
         try:
             curState  = self.getCurrentState()
         except:
             self.log.exception('Failed to get current state')
             return
 
-        nextState = self.scoreboard.rollup()
+        self.scoreboardLock.acquire()
 
-        for resource,users in nextState.items():
-            self.resources[resource].reconcile(curState,users)
+        try:
+            nextState = self.scoreboard.rollup(full)
+        finally:
+            self.scoreboardLock.release()
+
+        tasks = self.makeTasks(curState,nextState)
+        failed = self.executor.run(tasks)
+
+        if failed:
+            self.scoreboardLock.acquire()
+            self.scoreboard.markDirty(failed)
+            self.scoreboardLock.release()
+            raise IOError('Failed to change %s' % ' '.join(sorted(failed)))
+
+        self.log.info('  finished (%d resources, %d changed)' % \
+            (len(nextState),len(tasks)))
+
+    def makeTasks(self,curState,nextState):
+
+        # One task per resource that needs changing. Resources are
+        # turned on after the ones in their after list and off before
+        # them; there is no ordering between one going on and the
+        # other going off.
+
+        plans = {}
+
+        for name,entry in nextState.items():
+            transitions = self.resources[name].plan(curState,entry)
+            if transitions:
+                plans[name] = transitions
+
+        shutdown = dict([(name,self.resources[name].isShutdown(transitions))
+                         for name,transitions in plans.items()])
+
+        tasks = {}
+
+        for name,transitions in plans.items():
+
+            if shutdown[name]:
+                deps = set([other for other in plans
+                            if shutdown[other] and
+                            name in self.resources[other].after])
+            else:
+                deps = set([other for other in self.resources[name].after
+                            if other in plans and not shutdown[other]])
+
+            function = self.resources[name].apply
+            tasks[name] = (lambda function=function,transitions=transitions:
+                                function(transitions),deps)
+
+        return tasks
+
+    def recordLatency(self,resource,param,curState,nextState,secs):
 
-        self.log.info('  finished')
+        if param:
+            resource = '%s[%s]' % (resource,param)
+
+        if curState:
+            key = '%s %s->%s' % (resource,curState,nextState)
+        else:
+            key = '%s %s' % (resource,nextState)
+
+        self.log.info('  %s took %.2fs' % (key,secs))
+
+        self.latencyLock.acquire()
+
+        try:
+            count,total,last,longest = self.latencies.get(key,(0,0,0,0))
+            self.latencies[key] = (count+1,total+secs,secs,max(longest,secs))
+        finally:
+            self.latencyLock.release()
+
+    def latency(self):
+
+        # Time taken by each kind of state change and for each resource
+        # to warm up, in seconds
+
+        self.latencyLock.acquire()
+
+        try:
+            results = {}
+            for key,(count,total,last,longest) in self.latencies.items():
+                results[key] = dict(count=count,mean=total/count,last=last,
+                                    max=longest)
+            return results
+        finally:
+            self.latencyLock.release()
+
+    def invalidateStatus(self):
+        self.statusCache = None
+
+    def statusValid(self):
+        return self.statusCache and time.time()-self.statusTime<self.statusMaxAge
 
     def getCurrentState(self):
 
+        if self.statusValid():
+            return self.statusCache
+
         if self.statusCommand:
             output = self.runCommand(self.statusCommand)
         elif self.statusService:
@@ -295,6 +1076,9 @@ class ResourceMonitor(ProcessClient, XMLRPCServerMixin):
         curState = ConfigParser.ConfigParser()
         curState.readfp(buffer)
 
+        self.statusCache = curState
+        self.statusTime = time.time()
+
         return curState
 
     def runCommand(self,cmd):
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Check the hwmon reader against "sensors -u"
+#
+#   Compares HwmonReader.lines() with the _input lines of saved
+#   "sensors -u" output. By default this is the fake hwmon tree and
+#   output in testdata/, so the numbers can be checked anywhere:
+#
+#       ./checkhwmon.py
+#
+#   On the target, compare with the real sensors (values move
+#   between the two reads, so use --tolerance):
+#
+#       sensors -u | ./checkhwmon.py -p /sys/class/hwmon -s - -t 2
+#
+#   Exits with 1 if the names, order or values differ.
+#
+#   2026-10-19  Initial implementation
+#
+####################################################################
+
+from hwmon import HwmonReader
+
+import os
+import re
+import sys
+import optparse
+
+TestData = os.path.join(os.path.dirname(os.path.abspath(__file__)),'testdata')
+
+InputLine = re.compile(r'^\s+(\w+_input):\s+(\S+)$')
+
+def parseSensors(lines):
+    # [(name,value),...] from the _input lines
+    results = []
+    for line in lines:
+        match = InputLine.match(line.rstrip())
+        if match:
+            results.append((match.group(1),float(match.group(2))))
+    return results
+
+def compare(expected,actual,tolerance):
+
+    problems = []
+
+    expectedNames = [name for name,value in expected]
+    actualNames = [name for name,value in actual]
+
+    if expectedNames!=actualNames:
+        problems.append('sensors:  %s' % ' '.join(expectedNames))
+        problems.append('hwmon.py: %s' % ' '.join(actualNames))
+        return problems
+
+    for (name,want),(_,got) in zip(expected,actual):
+        if abs(want-got)>tolerance:
+            problems.append('%s: sensors %.3f, hwmon.py %.3f' % (name,want,got))
+
+    return problems
+
+if __name__ == '__main__':
+
+    parser = optparse.OptionParser(usage='%prog [options]')
+
+    parser.add_option('-p','--path',dest='path',
+                      default=os.path.join(TestData,'hwmon'),
+                      help='hwmon directory [%default]')
+    parser.add_option('-s','--sensors',dest='sensors',
+                      default=os.path.join(TestData,'sensors-u.txt'),
+                      help='"sensors -u" output, - for stdin [%default]')
+    parser.add_option('-t','--tolerance',dest='tolerance',type='float',
+                      default=0,help='allowed difference [%default]')
+
+    (options,args) = parser.parse_args()
+
+    if options.sensors=='-':
+        lines = sys.stdin.readlines()
+    else:
+        lines = open(options.sensors).readlines()
+
+    expected = parseSensors(lines)
+
+    reader = HwmonReader(options.path)
+    actual = parseSensors(['  '+line for line in reader.lines()])
+    reader.close()
+
+    problems = compare(expected,actual,options.tolerance)
+
+    for problem in problems:
+        print problem
+
+    if problems:
+        sys.exit(1)
+
+    print 'OK: %d sensors match' % len(expected)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Numato USB GPIO driver
+#
+#   Talks to the GPIO module over its serial port like the sbcctl
+#   program does, but keeps the port open between commands and
+#   reads each reply up to the '>' prompt instead of waiting for
+#   a fixed number of bytes (or the read timeout).
+#
+#   A reply is the echoed command, the result (if the command has
+#   one) and the prompt, separated by "\n\r". command() returns the
+#   result the same way sbcctl does.
+#
+#   Any error closes the port so that the next command opens it
+#   again. Needs pyserial; open() raises IOError without it.
+#
+#   2026-10-19  Initial implementation
+#
+####################################################################
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+from threading import Lock
+
+import time
+
+# Same mapping as support/bin/sbcctl
+
+DeviceToPin = {
+    'fan':      0,
+    'lna':      1,
+    'ettus':    2,
+    'ssd':      3,
+    'iridium':  4
+    }
+
+PinToDevice = dict([(pin,name) for (name,pin) in DeviceToPin.items()])
+
+PROMPT = '>'
+
+class NumatoGPIO:
+
+    def __init__(self,device='/dev/ttyACM0',baudrate=19200,timeout=1):
+        self.device     = device
+        self.baudrate   = baudrate
+        self.timeout    = timeout
+        self.port       = None
+        self.lock       = Lock()
+
+    def open(self):
+
+        if self.port:
+            return
+
+        if serial is None:
+            raise IOError('pyserial is not installed')
+
+        self.port = serial.Serial(self.device,self.baudrate,
+                                  timeout=self.timeout)
+
+    def readReply(self):
+
+        data = ''
+        endTime = time.time()+self.timeout
+
+        while not data.endswith(PROMPT):
+            if time.time()>endTime:
+                raise IOError('Timed out waiting for GPIO reply: %r' % data)
+            chunk = self.port.read(self.port.inWaiting() or 1)
+            if not chunk:
+                raise IOError('Timed out waiting for GPIO reply: %r' % data)
+            data += chunk
+
+        return data
+
+    def command(self,cmd):
+
+        self.lock.acquire()
+
+        try:
+            self.open()
+            # Drop anything left over from a command that timed out
+            self.port.flushInput()
+            self.port.write(cmd+'\r')
+            result = self.readReply().split('\n\r')
+        except:
+            self.close()
+            raise
+        finally:
+            self.lock.release()
+
+        if len(result)==3:
+            return result[1]
+        else:
+            return result[-1]
+
+    def readall(self):
+        return int(self.command('gpio readall'),16)
+
+    def close(self):
+        if self.port:
+            try:
+                self.port.close()
+            except:
+                pass
+            self.port = None
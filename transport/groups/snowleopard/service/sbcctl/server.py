@@ -13,13 +13,44 @@
 #   2016-07-18  Todd Valentic
 #               Add reading CPU temp sensors
 #
+#   2026-10-19  Read the GPIO pins and hwmon sensors in-process.
+#                   The GPIO serial port is kept open (numato.py) and
+#                   the sensors are read from /sys/class/hwmon with
+#                   the files held open (hwmon.py), giving the same
+#                   output as "sbcctl status" and "sensors -u". If
+#                   either fails, or native.gpio/native.sensors are
+#                   off, the programs are run as before. status()
+#                   results are reused for status.maxage seconds,
+#                   unless a pin has been changed since.
+#
+#   2026-10-19  Add apply(ops) to make several pin and device changes
+#                   in one request. The changes are made in turn
+#                   through the GPIO driver (or one "sbcctl apply"
+#                   run) and the resulting status is returned:
+#
+#                       sbcctl.apply([['device','ettus','on'],
+#                                     ['setpin',6,'off']])
+#
+#                   Every op is checked before any is made. setpin,
+#                   device, gpio and reset also use the driver now.
+#
 ###################################################################
 
 from Transport  import ProcessClient
 from Transport  import XMLRPCServerMixin
+from threading  import Lock
+from numato     import NumatoGPIO,DeviceToPin,PinToDevice
+from hwmon      import HwmonReader
 
 import sys
+import time
+import pytz
+import datetime
 import commands
+import numato
+import pipes
+
+VERSION = 1
 
 class Server(ProcessClient,XMLRPCServerMixin):
 
@@ -29,11 +60,29 @@ class Server(ProcessClient,XMLRPCServerMixin):
 
         self.sbcctlCmd = self.get('command.sbcctl','/bin/sbcctl')
 
+        self.statusMaxAge   = self.getfloat('status.maxage',2)
+        self.statusCache    = None
+        self.statusTime     = 0
+        self.lock           = Lock()
+
+        self.driver = None
+        self.hwmon = None
+
+        if self.getboolean('native.gpio',True):
+            if numato.serial:
+                self.driver = NumatoGPIO(self.get('gpio.device','/dev/ttyACM0'))
+            else:
+                self.log.info('No pyserial, using %s for GPIO' % self.sbcctlCmd)
+
+        if self.getboolean('native.sensors',True):
+            self.hwmon = HwmonReader(self.get('hwmon.path','/sys/class/hwmon'))
+
         self.register_function(self.status)
         self.register_function(self.setpin)
         self.register_function(self.reset)
         self.register_function(self.gpio)
         self.register_function(self.device)
+        self.register_function(self.apply)
 
         self.cache = self.connect('cache')
 
@@ -45,55 +94,187 @@ class Server(ProcessClient,XMLRPCServerMixin):
                 self.log.exception('Problem')
                 self.log.info('Waiting for device to be ready')
 
-    def readSensors(self):
-
-        cmd = '%s %s' % (self.sbcctl,' '.join([str(x) for x in args]))
-
-        status,output = commands.getstatusoutput(cmd)
-
-        self.log.info(cmd)
-
-        if status!=0:
-            self.log.error('Program running command')
-            self.log.error('  cmd:    %s' % cmd)
-            self.log.error('  status: %s' % status)
-            self.log.error('  output: %s' % output)
-            raise IOError('Problem running command')
+    def status(self,*pos,**kw):
 
-        return output
+        self.lock.acquire()
 
+        try:
+            if self.statusValid():
+                return self.statusCache
+            results = self.readStatus()
+            results += self.readSensors()
+            self.statusCache = results
+            self.statusTime = time.time()
+        finally:
+            self.lock.release()
 
-    def status(self,*pos,**kw):
-        results = self.sbcctl('status')
-        results += self.readSensors()
         self.cache.put('sbcctl',results)
+
         return results
 
+    def statusValid(self):
+        return self.statusCache and time.time()-self.statusTime<self.statusMaxAge
+
     def setpin(self,pin,state):
-        return self.sbcctl('setpin',pin,state)
+        return self.change('setpin',pin,state)
 
     def reset(self,pin,state):
-        return self.sbcctl('reset')
+        return self.change('reset')
 
     def gpio(self,*pos):
-        return self.sbcctl('gpio',*pos)
+        return self.change('gpio',*pos)
 
     def device(self,name,state):
-        return self.sbcctl('device',name,state)
+        return self.change('device',name,state)
+
+    def change(self,*pos):
+        self.lock.acquire()
+        try:
+            self.statusCache = None
+            gpioCommands = self.translate(pos)
+            if self.runDriver(gpioCommands):
+                return ''
+            return self.sbcctl(*pos)
+        finally:
+            self.lock.release()
+
+    def apply(self,ops):
+
+        # ops is a list of [command,args...] as for the individual
+        # calls. Returns the status after the changes.
+
+        self.lock.acquire()
+
+        try:
+            self.statusCache = None
+
+            gpioCommands = []
+            for op in ops:
+                gpioCommands.extend(self.translate(op))
+
+            if self.runDriver(gpioCommands):
+                results = self.readStatus()
+            else:
+                args = [pipes.quote(' '.join([str(x) for x in op])) for op in ops]
+                results = self.sbcctl('apply',*args)
+
+            results += self.readSensors()
+            self.statusCache = results
+            self.statusTime = time.time()
+        finally:
+            self.lock.release()
+
+        self.cache.put('sbcctl',results)
+
+        return results
+
+    def translate(self,op):
+
+        # The GPIO module commands for an op, as sbcctl would send them
+
+        op = [str(x) for x in op]
+
+        if not op:
+            raise ValueError('Empty op')
+
+        command,args = op[0],op[1:]
+
+        if command=='setpin' and len(args)==2:
+            pin,state = args
+            if state in ['0','off']:
+                return ['gpio clear %d' % int(pin)]
+            elif state in ['1','on']:
+                return ['gpio set %d' % int(pin)]
+            raise ValueError('Unknown state: %s' % state)
+
+        if command=='device' and len(args)==2:
+            name,state = args
+            if name not in DeviceToPin:
+                raise ValueError('Unknown device: %s' % name)
+            return self.translate(['setpin',DeviceToPin[name],state])
+
+        if command=='gpio' and args:
+            return [' '.join(args)]
+
+        if command=='reset':
+            return ['gpio iomask ff','gpio iodir 00','gpio writeall 00']
+
+        raise ValueError('Unknown op: %s' % ' '.join(op))
+
+    def runDriver(self,gpioCommands):
+
+        # Called with the lock held. False if the changes have to be
+        # made with sbcctl instead. The ops are all idempotent, so it
+        # doesn't matter if some were made before a failure.
+
+        if not self.driver:
+            return False
+
+        try:
+            for cmd in gpioCommands:
+                self.driver.command(cmd)
+        except:
+            self.log.exception('Problem with GPIO, trying %s' % self.sbcctlCmd)
+            return False
+
+        return True
 
     def sbcctl(self,*pos):
         return self.runCommand(self.sbcctlCmd,*pos)
 
+    def formatStatus(self,pins):
+
+        # Same as "sbcctl status"
+
+        timestamp = datetime.datetime.utcnow()
+        timestamp = timestamp.replace(tzinfo=pytz.utc,microsecond=0)
+
+        output = []
+
+        output.append('[metadata]')
+        output.append('version: %s' % VERSION)
+        output.append('timestamp: %s' % timestamp)
+
+        output.append('[GPIO]')
+        for bit in range(8):
+            output.append('Pin %d: %d' % (bit,bool(pins & 1<<bit)))
+
+        output.append('[Device]')
+        for pin in range(8):
+            if pin in PinToDevice:
+                output.append('%s: %d' % (PinToDevice[pin],bool(pins & 1<<pin)))
+
+        return '\n'.join(output)
+
+    def readStatus(self):
+
+        if self.driver:
+            try:
+                return self.formatStatus(self.driver.readall())
+            except:
+                self.log.exception('Problem reading GPIO, trying %s' % \
+                    self.sbcctlCmd)
+
+        return self.sbcctl('status')
+
     def readSensors(self):
-        data = self.runCommand('sensors -u')
+
+        lines = None
+
+        if self.hwmon:
+            try:
+                lines = self.hwmon.lines()
+            except:
+                self.log.exception('Problem reading hwmon, trying sensors')
+
+        if lines is None:
+            data = self.runCommand('sensors -u')
+            lines = [line.strip() for line in data.split('\n') if '_input' in line]
 
         output = []
         output.append('')
         output.append('[sensors]')
-
-        for line in data.split('\n'):
-            if '_input' in line:
-                output.append(line.strip())
+        output.extend(lines)
 
         return '\n'.join(output)
 
@@ -4,28 +4,36 @@ import sys
 sys.path.append('/opt/transport/groups/snowleopard/support/lib')
 
 from directory import Directory
+from sharedcache import SharedCache
 import sunsaver
 import time
-import md5
 import pprint
 
 directory = Directory()
 cache = directory.connect('cache')
+shared = SharedCache()
 
-prevResults = None
+def wait(version):
+
+    # The shared memory copy if there is one, else the cache service
+
+    try:
+        return shared.wait('sunsaver',version,60)
+    except (IOError,OSError):
+        return cache.wait('sunsaver',version,60)
+
+version = 0
 
 while True:
 
     try:
-        data = cache.get('sunsaver')
+        result = wait(version)
     except:
-        continue
-    finally:
         time.sleep(1)
+        continue
 
-    curResults = md5.new(str(data)).hexdigest()
-
-    if prevResults!=curResults:
+    if result:
+        version,data = result
         results = sunsaver.Parse(data)
         print '-'*70
         print time.ctime()
@@ -33,5 +41,3 @@ while True:
         pprint.pprint(results)
         print '-'*70
         print
-
-        prevResults=curResults
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+###################################################################
+#
+#   Parallel block compression
+#
+#   The input is read in fixed sized blocks and each block is
+#   compressed as an independent stream by a pool of worker
+#   processes. The streams are written out in order, giving a
+#   standard multi-stream .bz2 (like pbzip2) or .xz file that the
+#   usual command line tools can decompress.
+#
+#   Only a window of blocks is in flight at any time, so memory
+#   use is bounded by roughly 2 x window x blocksize.
+#
+#   The worker pool is started on the first file and reused for
+#   later ones until close() is called. Each block is timed in the
+#   worker that compresses it and the CPU seconds are added up in
+#   cpuTime, so it only counts the compression itself.
+#
+#   2026-10-19  Initial implementation. Shared by the exchange
+#                   service and the backup monitor.
+#
+#   2026-10-19  Add zlib codec (gzip format) and chooseCodec() for
+#                   picking a codec by trial compression.
+#
+###################################################################
+
+import os
+import bz2
+import time
+import zlib
+import collections
+import multiprocessing
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+def compressBZ2(data,level):
+    return bz2.compress(data,level)
+
+def compressLZMA(data,level):
+    return lzma.compress(data,preset=level)
+
+def compressZlib(data,level):
+    # gzip wrapper so that concatenated members are a valid .gz file
+    compressor = zlib.compressobj(level,zlib.DEFLATED,16+zlib.MAX_WBITS)
+    return compressor.compress(data)+compressor.flush()
+
+# name: (function, file extension, default level, default blocksize)
+
+Codecs = {
+    'zlib': (compressZlib,  '.gz',  6, 1024*1024),
+    'bz2':  (compressBZ2,   '.bz2', 9, 900*1000),
+    'lzma': (compressLZMA,  '.xz',  6, 8*1024*1024),
+    }
+
+def available(codec):
+    if codec=='lzma':
+        return lzma is not None
+    return codec in Codecs
+
+def extension(codec):
+    return Codecs[codec][1]
+
+def chooseCodec(data,candidates,threshold):
+
+    # Trial compress data with each of the candidate codecs. Returns
+    # the codec with the smallest ratio (compressed/original size)
+    # below threshold, or 'none' if nothing does better, along with
+    # the ratio for each codec tried.
+
+    best = 'none'
+    ratios = {}
+
+    if not data:
+        return best,ratios
+
+    for codec in candidates:
+        if not available(codec):
+            continue
+
+        level = Codecs[codec][2]
+        ratio = len(compressBlock((codec,level,data)))/float(len(data))
+        ratios[codec] = ratio
+
+        if ratio<threshold and (best=='none' or ratio<ratios[best]):
+            best = codec
+
+    return best,ratios
+
+def compressBlock(args):
+    codec,level,data = args
+    return Codecs[codec][0](data,level)
+
+def compressTimed(args):
+    # Runs in the worker processes. Returns the compressed stream
+    # and the CPU seconds taken.
+    start = time.clock()
+    data = compressBlock(args)
+    return data,time.clock()-start
+
+class BlockCompressor:
+
+    def __init__(self,codec='bz2',level=None,blockSize=None,workers=None):
+
+        if codec not in Codecs:
+            raise ValueError('Unknown codec: %s' % codec)
+
+        if not available(codec):
+            raise ValueError('Codec is not available: %s' % codec)
+
+        func,ext,defaultLevel,defaultBlockSize = Codecs[codec]
+
+        if level is None:
+            level = defaultLevel
+
+        self.codec      = codec
+        self.level      = level
+        self.blockSize  = blockSize or defaultBlockSize
+        self.workers    = workers or multiprocessing.cpu_count()
+        self.window     = 2*self.workers
+        self.pool       = None
+        self.cpuTime    = 0
+
+    def getPool(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def compress(self,input):
+
+        # Generator over the compressed streams for file object input
+
+        pool = self.getPool()
+        pending = collections.deque()
+
+        try:
+            while True:
+                while len(pending)<self.window:
+                    data = input.read(self.blockSize)
+                    if not data:
+                        break
+                    args = (self.codec,self.level,data)
+                    pending.append(pool.apply_async(compressTimed,(args,)))
+
+                if not pending:
+                    break
+
+                data,secs = pending.popleft().get()
+                self.cpuTime += secs
+
+                yield data
+        finally:
+            # Stopped part way through, don't leave the blocks still
+            # in the pool ahead of the next file
+            if pending:
+                self.close()
+
+    def compressFile(self,srcname,destname):
+
+        # Returns number of bytes written
+
+        input = open(srcname,'rb')
+        output = open(destname,'wb')
+        numBytes = 0
+
+        try:
+            for data in self.compress(input):
+                output.write(data)
+                numBytes += len(data)
+        except:
+            output.close()
+            os.remove(destname)
+            raise
+        finally:
+            input.close()
+            output.close()
+
+        return numBytes
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+####################################################################
+#
+#   Shared memory view of the cache service
+#
+#   The cache server publishes its entries into a memory mapped
+#   file so that local clients can read them without an XML-RPC
+#   request. Writes still go through the server.
+#
+#   Layout (network byte order):
+#
+#       magic       'SLC1'
+#       sequence    uint32
+#       length      uint32
+#       data        pickled {key: (version,time,ttl,writer,stale,value)}
+#
+#   The sequence works as a seqlock. The server makes it odd before
+#   changing the data and even again once done. A reader takes the
+#   sequence, copies the data and checks the sequence again. If it
+#   was odd or has moved on the copy is thrown away and the read is
+#   retried. Readers keep the last decoded entries, so while the
+#   sequence hasn't changed a read is just a 4 byte compare.
+#
+#   The file only ever grows. A reader whose mapping is shorter than
+#   the data maps the file again.
+#
+#   Usage:
+#
+#       cache = SharedCache()
+#       value = cache.get('sunsaver')
+#
+#   As with the server, get() raises KeyError for keys that are
+#   missing or expired. If the server isn't running the last
+#   published values are still read; the time in snapshot() shows
+#   how old they are.
+#
+#   wait() works like the server's, but polls the sequence instead of
+#   holding a request thread in the server.
+#
+#   2026-10-19  Initial implementation
+#
+#   2026-10-19  Add wait()
+#
+####################################################################
+
+import os
+import mmap
+import time
+import struct
+import cPickle
+
+DefaultPath = '/dev/shm/snowleopard-cache'
+
+HEADER      = '!4sII'
+HEADER_SIZE = struct.calcsize(HEADER)
+MAGIC       = 'SLC1'
+
+class SharedCacheWriter:
+
+    def __init__(self,path=DefaultPath,size=64*1024):
+
+        self.path = path
+
+        fd = os.open(path,os.O_RDWR | os.O_CREAT,0644)
+
+        try:
+            if os.fstat(fd).st_size<size:
+                os.ftruncate(fd,size)
+            self.map = mmap.mmap(fd,os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+
+        magic,self.seq,length = struct.unpack(HEADER,self.map[:HEADER_SIZE])
+
+        if magic!=MAGIC:
+            self.seq,length = 0,0
+
+        # Readers wait (the sequence stays odd) until our first publish,
+        # in case the last one stopped in the middle of a write.
+
+        self.seq = self.seq | 1
+        self.map[:HEADER_SIZE] = struct.pack(HEADER,MAGIC,self.seq,length)
+
+    def setSequence(self,seq):
+        self.seq = seq & 0xffffffff
+        self.map[4:8] = struct.pack('!I',self.seq)
+
+    def grow(self,needed):
+
+        size = len(self.map)
+        while size<needed:
+            size *= 2
+
+        fd = os.open(self.path,os.O_RDWR)
+
+        try:
+            os.ftruncate(fd,size)
+            newmap = mmap.mmap(fd,size)
+        finally:
+            os.close(fd)
+
+        self.map.close()
+        self.map = newmap
+
+    def publish(self,entries):
+
+        data = cPickle.dumps(entries,cPickle.HIGHEST_PROTOCOL)
+
+        if HEADER_SIZE+len(data)>len(self.map):
+            self.grow(HEADER_SIZE+len(data))
+
+        if self.seq%2==0:
+            self.setSequence(self.seq+1)
+
+        self.map[HEADER_SIZE:HEADER_SIZE+len(data)] = data
+        self.map[8:12] = struct.pack('!I',len(data))
+        self.setSequence(self.seq+1)
+
+    def close(self):
+        self.map.close()
+
+class SharedCache:
+
+    def __init__(self,path=DefaultPath,timeout=1.0):
+        self.path       = path
+        self.timeout    = timeout
+        self.map        = None
+        self.seq        = None
+        self.entries    = {}
+
+    def open(self):
+
+        if self.map:
+            self.map.close()
+
+        fp = open(self.path,'rb')
+
+        try:
+            self.map = mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+        if self.map[:4]!=MAGIC:
+            raise IOError('Not a shared cache: %s' % self.path)
+
+    def read(self):
+
+        if not self.map:
+            self.open()
+
+        endTime = None
+
+        while True:
+
+            seq = struct.unpack('!I',self.map[4:8])[0]
+
+            if seq==self.seq:
+                return self.entries
+
+            # Only the retries need the clock
+
+            if endTime is None:
+                endTime = time.time()+self.timeout
+            elif time.time()>endTime:
+                raise IOError('Timed out reading shared cache')
+
+            if seq%2:
+                time.sleep(0.0001)
+                continue
+
+            length = struct.unpack('!I',self.map[8:12])[0]
+
+            if HEADER_SIZE+length>len(self.map):
+                self.open()
+                continue
+
+            data = self.map[HEADER_SIZE:HEADER_SIZE+length]
+
+            if struct.unpack('!I',self.map[4:8])[0]!=seq:
+                time.sleep(0.0001)
+                continue
+
+            self.entries = cPickle.loads(data)
+            self.seq = seq
+
+            return self.entries
+
+    def live(self,entries,key,now):
+        entry = entries.get(key)
+        if entry:
+            version,timestamp,ttl,writer,stale,value = entry
+            if not ttl or now<=timestamp+ttl:
+                return entry
+        return None
+
+    def get(self,key):
+        entry = self.live(self.read(),key,time.time())
+        if not entry:
+            raise KeyError(key)
+        return entry[-1]
+
+    def getMany(self,keys):
+        # All from the same version of the cache
+        entries = self.read()
+        now = time.time()
+        results = {}
+        for key in keys:
+            entry = self.live(entries,key,now)
+            if entry:
+                results[key] = entry[-1]
+        return results
+
+    def version(self,key):
+        entry = self.live(self.read(),key,time.time())
+        return entry and entry[0] or 0
+
+    def wait(self,key,since=0,timeout=60,interval=0.1):
+
+        # [version,value] once key is newer than since, else False.
+        # As with the server, a version newer than any published is
+        # from before a restart.
+
+        endTime = time.time()+timeout
+
+        versions = [entry[0] for entry in self.read().values()]
+
+        if since>max(versions or [0]):
+            since = 0
+
+        while True:
+            entry = self.live(self.read(),key,time.time())
+            if entry and entry[0]>since:
+                return [entry[0],entry[-1]]
+            if time.time()>=endTime:
+                return False
+            time.sleep(interval)
+
+    def list(self):
+        entries = self.read()
+        now = time.time()
+        return [key for key in entries.keys() if self.live(entries,key,now)]
+
+    def snapshot(self):
+        entries = self.read()
+        now = time.time()
+        results = {}
+        for key in entries.keys():
+            entry = self.live(entries,key,now)
+            if entry:
+                version,timestamp,ttl,writer,stale,value = entry
+                results[key] = dict(value=value,version=version,time=timestamp,
+                                    ttl=ttl,writer=writer,stale=stale)
+        return results
+
+    def close(self):
+        if self.map:
+            self.map.close()
+            self.map = None